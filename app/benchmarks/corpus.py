@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import random
+import orjson
+from elasticsearch_async import AsyncElasticsearch
+import elastic
+
+
+WORDS = ["vintage", "leather", "wallet", "handmade", "ceramic", "mug", "bitcoin", "hardware", "miner", "organic",
+         "coffee", "beans", "tea", "poster", "print", "canvas", "art", "ebook", "guide", "course", "consulting",
+         "design", "logo", "website", "shirt", "hoodie", "sticker", "pack", "jewellery", "silver", "gold", "ring",
+         "necklace", "knife", "camping", "tent", "backpack", "sneakers", "vinyl", "record", "album", "camera",
+         "lens", "phone", "case", "charger", "cable", "keyboard", "mouse", "monitor", "chair", "desk", "lamp"]
+
+with open("responseTemplate.json", encoding="utf-8") as file:
+    template = json.load(file)
+COUNTRIES = [option["value"].upper() for option in template["options"]["shipsTo"]["options"] if option["value"] != "any"]
+CURRENCIES = [option["value"].upper() for option in template["options"]["acceptedCurrencies"]["options"]]
+CONTRACT_TYPES = [option["value"].upper() for option in template["options"]["contractTypes"]["options"]]
+
+
+def makeDocument(index: int, rng: random.Random):
+    listingID = "zb2rh{:046d}".format(index)
+    peerID = "Qm{:044d}".format(rng.randrange(max(1, index//20) + 1))
+    title = " ".join(rng.sample(WORDS, 3))
+    amount = rng.randint(100, 1000000)
+    return {
+        "listingID": listingID,
+        "peerID": peerID,
+        "description": " ".join(rng.choice(WORDS) for _ in range(30)),
+        "tags": rng.sample(WORDS, 3),
+        "categories": rng.sample(WORDS, 1),
+        "equivalentBitcoinPrice": amount*10,
+        "contractType": rng.choice(CONTRACT_TYPES),
+        "language": "en",
+        "shipsTo": ["ANY"] if rng.random() < 0.3 else rng.sample(COUNTRIES, rng.randint(1, 10)),
+        "condition": "NEW",
+        "acceptedCurrencies": rng.sample(CURRENCIES, rng.randint(1, len(CURRENCIES))),
+        "moderators": [],
+        "listingData": {
+            "hash": listingID,
+            "slug": "-".join(title.split()),
+            "title": title,
+            "thumbnail": {"tiny": "zb2rhtiny", "small": "zb2rhsmall", "medium": "zb2rhmedium"},
+            "language": "en",
+            "price": {"amount": amount, "currencyCode": "USD", "modifier": 0},
+            "averageRating": round(rng.uniform(0, 5), 1),
+            "ratingCount": rng.randint(0, 50),
+            "freeShipping": [],
+            "coinType": "",
+            "nsfw": rng.random() < 0.05
+        },
+        "peerData": {"peerID": peerID, "name": "Vendor {}".format(peerID[-6:]), "avatarHashes": {"tiny": "zb2rhavatar"}}
+    }
+
+
+async def loadCorpus(es, index: str, size: int, batchSize: int = 1000, seed: int = 0, create: bool = True):
+    rng = random.Random(seed)
+    if create:
+        if index in (elastic.READ_ALIAS, elastic.WRITE_ALIAS) or index.startswith(elastic.READ_ALIAS + "-"):
+            raise SystemExit("refusing to replace {}, it is the live listings index, set BENCHMARK_INDEX to a scratch index name".format(index))
+        await es.indices.delete(index=index, ignore=404)
+        await es.indices.create(index=index, body=elastic.LISTINGS_MAPPING)
+    for batchStart in range(0, size, batchSize):
+        lines = []
+        for documentIndex in range(batchStart, min(size, batchStart + batchSize)):
+            document = makeDocument(documentIndex, rng)
+            lines.append(orjson.dumps({"index": {"_index": index, "_id": document["listingID"]}}))
+            lines.append(orjson.dumps(document))
+        response = await es.bulk(body=(b"\n".join(lines) + b"\n").decode("utf-8"))
+        if response["errors"]:
+            raise RuntimeError("bulk load into {} failed".format(index))
+    await es.indices.refresh(index=index)
+    print("loaded", size, "synthetic listings into", index)
+
+
+async def main():
+    es = AsyncElasticsearch([os.environ.get("ELASTICSEARCH_HOST", "localhost")])
+    try:
+        await loadCorpus(es,
+                         os.environ.get("BENCHMARK_INDEX", "benchmark-listings"),
+                         int(os.environ.get("BENCHMARK_CORPUS_SIZE", 20000)))
+    finally:
+        await es.transport.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import resource
+import tempfile
+import time
+from elasticsearch_async import AsyncElasticsearch
+import crawler
+import db
+import elastic
+import importer
+import log
+import obrequests
+import rates
+import updater
+from benchmarks import fakeopenbazaar
+
+
+def peakRSS():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+def requestDelta(before: dict, after: dict):
+    return {route: after[route] - before.get(route, 0) for route in after if after[route] - before.get(route, 0) > 0}
+
+
+def report(phase: str, elapsed: float, peers: int, listings: int, requests: dict):
+    print("{:<8} {:>8.2f}s {:>7} peers {:>9.1f} peers/s {:>8} listings {:>10.1f} listings/s {:>8} requests {:>8.1f}MB peak RSS".format(
+        phase, elapsed, peers, peers/elapsed if elapsed > 0 else 0, listings, listings/elapsed if elapsed > 0 else 0,
+        requests.get("requests", 0), peakRSS()))
+    print("         " + ", ".join("{} {}".format(route, count) for route, count in sorted(requests.items()) if route != "requests"))
+
+
+async def resetState():
+    if elastic.READ_ALIAS == "listings":
+        raise SystemExit("set ELASTICSEARCH_INDEX to a scratch index name such as benchmark-listings, its indices are deleted on every run")
+    async with db.acquire() as connection:
+        known = await connection.fetchval("SELECT count(*) FROM newPeers;")
+        if known > 0 and os.environ.get("BENCHMARK_RESET", "false").lower() != "true":
+            raise SystemExit("the benchmark database already has {} peers, point POSTGRESQL_DB at a scratch database or set BENCHMARK_RESET=true to truncate it".format(known))
+        await connection.execute("TRUNCATE newPeers, peerEdges, peers, listings;")
+    es = AsyncElasticsearch([os.environ["ELASTICSEARCH_HOST"]])
+    try:
+        await es.indices.delete(index=elastic.READ_ALIAS + "-*", ignore=404)
+    finally:
+        await es.transport.close()
+
+
+async def runPhase(phase: str, counters: dict, passFunction):
+    before = dict(counters)
+    start = time.perf_counter()
+    peers, listings = await passFunction()
+    report(phase, time.perf_counter() - start, peers, listings, requestDelta(before, counters))
+
+
+async def crawlPhase():
+    await crawler.importConnectedPeers()
+    await crawler.importFollowPeers()
+    passes = int(os.environ.get("BENCHMARK_CRAWL_PASSES", 20))
+    for _ in range(passes):
+        # stop once the frontier has nothing left that is due for a crawl
+        seeds, _ = await crawler.crawlPass()
+        if seeds == 0:
+            break
+    return len(crawler.knownPeers), 0
+
+
+async def importPhase():
+    peers = 0
+    listings = 0
+    while True:
+        listingCounts = await importer.insertPass()
+        if len(listingCounts) == 0:
+            return peers, listings
+        peers += len(listingCounts)
+        listings += sum(listingCounts)
+
+
+async def updatePhase():
+    peers = 0
+    listings = 0
+    while True:
+        leasedPeers, listingCounts = await updater.updatePass()
+        if len(leasedPeers) == 0:
+            return peers, listings
+        peers += len(listingCounts)
+        listings += sum(listingCounts)
+
+
+async def main():
+    peerCount = int(os.environ.get("FAKE_OB_PEERS", 1000))
+    listingsPerPeer = int(os.environ.get("FAKE_OB_LISTINGS_PER_PEER", 20))
+    latency = float(os.environ.get("FAKE_OB_LATENCY", 0.005))
+    failureRate = float(os.environ.get("FAKE_OB_FAILURE_RATE", 0.1))
+    degree = int(os.environ.get("FAKE_OB_DEGREE", 8))
+    os.environ.setdefault("OPENBAZAAR_HOST", "127.0.0.1")
+    os.environ.setdefault("OPENBAZAAR_PORT", "4102")
+    os.environ.setdefault("OPENBAZAAR_USER", "openbazaar")
+    os.environ.setdefault("OPENBAZAAR_PASS", "benchmark")
+    log.logger.setLevel(os.environ.get("LOG_LEVEL", "WARNING").upper())
+
+    app = fakeopenbazaar.createApp(peerCount, listingsPerPeer, latency, failureRate, degree)
+    fakeopenbazaar.startInThread(app, os.environ["OPENBAZAAR_HOST"], int(os.environ["OPENBAZAAR_PORT"]))
+    print("fake node: {} peers ({} offline), {} listings per peer, {:.1f}ms latency".format(
+        peerCount, len(app["offline"]), listingsPerPeer, latency*1000))
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as ratesFile:
+        json.dump({"USD": 10000.0}, ratesFile)
+    rates.RATES_FILE = ratesFile.name
+
+    await db.init()
+    try:
+        await resetState()
+        await obrequests.init()
+        await elastic.init()
+    except BaseException:
+        await db.close()
+        os.remove(ratesFile.name)
+        raise
+    try:
+        counters = app["counters"]
+        await runPhase("crawl", counters, crawlPhase)
+        await runPhase("import", counters, importPhase)
+        await runPhase("update", counters, updatePhase)
+    finally:
+        await obrequests.close()
+        await elastic.close()
+        await db.close()
+        os.remove(ratesFile.name)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import random
+import threading
+from aiohttp import web
+
+
+def makePeerID(index: int):
+    return "Qm{:044d}".format(index)
+
+
+def makeBasicListing(peerID: str, index: int):
+    return {
+        "hash": "zb2{}{:06d}".format(peerID[-40:], index),
+        "slug": "listing-{}".format(index),
+        "title": "Synthetic listing {}".format(index),
+        "description": "A synthetic listing used for benchmarking",
+        "tags": ["benchmark", "synthetic"],
+        "categories": ["Benchmarks"],
+        "contractType": "PHYSICAL_GOOD",
+        "language": "en",
+        "shipsTo": ["ALL"],
+        "acceptedCurrencies": ["BTC", "BCH"],
+        "thumbnail": {"tiny": "", "small": "", "medium": ""},
+        "price": {"amount": 1000 + index, "currencyCode": "USD", "modifier": 0},
+        "averageRating": 0,
+        "ratingCount": 0,
+        "coinType": "",
+        "nsfw": False
+    }
+
+
+def makeDetailedListing(basicListing: dict):
+    return {
+        "listing": {
+            "slug": basicListing["slug"],
+            "moderators": [],
+            "metadata": {"pricingCurrency": basicListing["price"]["currencyCode"]},
+            "item": {"condition": "NEW", "price": basicListing["price"]["amount"]}
+        }
+    }
+
+
+def makeProfile(peerID: str, index: int):
+    return {
+        "peerID": peerID,
+        "name": "Synthetic peer {}".format(index),
+        "handle": "",
+        "location": "",
+        "about": "A synthetic peer used for benchmarking",
+        "nsfw": False,
+        "vendor": True,
+        "moderator": False,
+        "avatarHashes": {"tiny": "", "small": "", "medium": "", "large": "", "original": ""}
+    }
+
+
+def makeGraph(peers: list, degree: int, rng: random.Random):
+    closest = dict()
+    following = dict()
+    followers = {peerID: [] for peerID in peers}
+    for peerID in peers:
+        neighbours = rng.sample(peers, min(degree, len(peers)))
+        closest[peerID] = neighbours
+        following[peerID] = neighbours[:max(1, degree//2)]
+        for followed in following[peerID]:
+            followers[followed].append(peerID)
+    return closest, following, followers
+
+
+def createApp(peerCount: int = 100, listingsPerPeer: int = 20, latency: float = 0.0,
+              failureRate: float = 0.0, degree: int = 8, connectedPeers: int = 20, offlineDelay: float = 0.2, seed: int = 0):
+
+    rng = random.Random(seed)
+    peers = [makePeerID(index) for index in range(peerCount)]
+    peerIndices = {peerID: index for index, peerID in enumerate(peers)}
+    offline = set(peerID for peerID in peers if rng.random() < failureRate)
+    closest, following, followers = makeGraph(peers, degree, rng)
+    counters = {"requests": 0}
+
+    @web.middleware
+    async def simulateNode(request, handler):
+        counters["requests"] += 1
+        route = request.match_info.route.name or "unknown"
+        counters[route] = counters.get(route, 0) + 1
+        if latency > 0:
+            await asyncio.sleep(random.uniform(0, 2*latency))
+        return await handler(request)
+
+    async def peerOffline():
+        # a real node spends its own timeout looking for an offline peer before giving up
+        await asyncio.sleep(offlineDelay)
+        return web.json_response({"success": False, "reason": "peer not found"}, status=500)
+
+    def isOnline(peerID: str):
+        return peerID in peerIndices and peerID not in offline
+
+    async def getPeers(request):
+        return web.json_response(peers[:connectedPeers])
+
+    async def getOwnFollowers(request):
+        return web.json_response(peers[connectedPeers:2*connectedPeers])
+
+    async def getOwnFollowing(request):
+        return web.json_response(peers[2*connectedPeers:3*connectedPeers])
+
+    async def getProfile(request):
+        peerID = request.match_info["peerID"]
+        if not isOnline(peerID):
+            return await peerOffline()
+        return web.json_response(makeProfile(peerID, peerIndices[peerID]))
+
+    async def getListings(request):
+        peerID = request.match_info["peerID"]
+        if peerID in offline:
+            return await peerOffline()
+        return web.json_response([makeBasicListing(peerID, index) for index in range(listingsPerPeer)])
+
+    async def getListing(request):
+        peerID = request.match_info["peerID"]
+        if peerID in offline:
+            return await peerOffline()
+        listingHash = request.match_info["listingHash"]
+        index = int(listingHash[-6:])
+        return web.json_response(makeDetailedListing(makeBasicListing(peerID, index)))
+
+    async def getClosestPeers(request):
+        return web.json_response(closest.get(request.match_info["peerID"], []))
+
+    async def getFollowing(request):
+        peerID = request.match_info["peerID"]
+        if not isOnline(peerID):
+            return await peerOffline()
+        return web.json_response(following[peerID])
+
+    async def getFollowers(request):
+        peerID = request.match_info["peerID"]
+        if not isOnline(peerID):
+            return await peerOffline()
+        return web.json_response(followers[peerID])
+
+    async def getStatus(request):
+        peerID = request.match_info["peerID"]
+        return web.json_response({"peerId": peerID, "status": "online" if isOnline(peerID) else "offline"})
+
+    app = web.Application(middlewares=[simulateNode])
+    app["peers"] = peers
+    app["offline"] = offline
+    app["counters"] = counters
+    app.router.add_get("/ob/peers", getPeers, name="peers")
+    app.router.add_get("/ob/followers", getOwnFollowers, name="followers")
+    app.router.add_get("/ob/following", getOwnFollowing, name="following")
+    app.router.add_get("/ob/profile/{peerID}", getProfile, name="profile")
+    app.router.add_get("/ob/listings/{peerID}", getListings, name="listings")
+    app.router.add_get("/ob/listing/{peerID}/{listingHash}", getListing, name="listing")
+    app.router.add_get("/ob/closestpeers/{peerID}", getClosestPeers, name="closestpeers")
+    app.router.add_get("/ob/followers/{peerID}", getFollowers, name="peerFollowers")
+    app.router.add_get("/ob/following/{peerID}", getFollowing, name="peerFollowing")
+    app.router.add_get("/ob/status/{peerID}", getStatus, name="status")
+    return app
+
+
+def startInThread(app: web.Application, host: str, port: int):
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+
+
+if __name__ == "__main__":
+    web.run_app(createApp(int(os.environ.get("FAKE_OB_PEERS", 100)),
+                          int(os.environ.get("FAKE_OB_LISTINGS_PER_PEER", 20)),
+                          float(os.environ.get("FAKE_OB_LATENCY", 0)),
+                          float(os.environ.get("FAKE_OB_FAILURE_RATE", 0)),
+                          int(os.environ.get("FAKE_OB_DEGREE", 8))),
+                port=int(os.environ.get("OPENBAZAAR_PORT", 4002)))
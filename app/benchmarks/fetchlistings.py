@@ -0,0 +1,61 @@
+import asyncio
+import aiohttp
+import os
+import time
+import obrequests
+from benchmarks import fakeopenbazaar
+
+
+async def perCallSessionSend(endpoint: str):
+    # swapped in under asyncRequest, so both sides go through the same limiters and retries
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get("http://{}:{}@{}:{}{}".format(obrequests.OPENBAZAAR_USER, obrequests.OPENBAZAAR_PASS, obrequests.OPENBAZAAR_HOST, obrequests.OPENBAZAAR_PORT, endpoint), timeout=obrequests.REQUEST_TIMEOUT) as response:
+                data = await response.json(content_type=None)
+    except asyncio.TimeoutError:
+        return "timeout", None
+    except (aiohttp.ClientError, ConnectionError, ValueError):
+        return "error", None
+    if type(data) == dict and data.get("success") == False:
+        return "failure", data
+    return "ok", data
+
+
+async def run(peers: list, counters: dict):
+    counters["requests"] = 0
+    # every run starts from the same limits instead of what the previous run learned
+    obrequests.limiters = {budget: obrequests.createLimiter(budget) for budget in obrequests.limiters}
+    start = time.perf_counter()
+    listings = await asyncio.gather(*[obrequests.fetchListings(peerID) for peerID in peers])
+    elapsed = time.perf_counter() - start
+    listingCount = sum(len(peerListings) for peerListings in listings if peerListings)
+    return counters["requests"], listingCount, elapsed
+
+
+async def main():
+    peerCount = int(os.environ.get("FAKE_OB_PEERS", 50))
+    listingsPerPeer = int(os.environ.get("FAKE_OB_LISTINGS_PER_PEER", 40))
+    latency = float(os.environ.get("FAKE_OB_LATENCY", 0.005))
+    os.environ.setdefault("OPENBAZAAR_HOST", "127.0.0.1")
+    os.environ.setdefault("OPENBAZAAR_PORT", "4102")
+    os.environ.setdefault("OPENBAZAAR_USER", "openbazaar")
+    os.environ.setdefault("OPENBAZAAR_PASS", "benchmark")
+
+    app = fakeopenbazaar.createApp(peerCount, listingsPerPeer, latency)
+    fakeopenbazaar.startInThread(app, os.environ["OPENBAZAAR_HOST"], int(os.environ["OPENBAZAAR_PORT"]))
+
+    await obrequests.init()
+    pooledSend = obrequests.sendRequest
+    try:
+        for name, send in [("per-call session", perCallSessionSend), ("pooled session", pooledSend)]:
+            obrequests.sendRequest = send
+            requests, listingCount, elapsed = await run(app["peers"], app["counters"])
+            print("{:<18} {:>6} requests {:>6} listings {:>8.2f}s {:>10.1f} requests/s".format(
+                name, requests, listingCount, elapsed, requests/elapsed))
+    finally:
+        obrequests.sendRequest = pooledSend
+        await obrequests.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
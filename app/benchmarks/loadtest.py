@@ -0,0 +1,154 @@
+import asyncio
+import os
+import random
+import time
+import urllib.parse
+import orjson
+from elasticsearch_async import AsyncElasticsearch
+import db
+import elastic
+import metrics
+import searchcache
+import server
+from benchmarks import corpus
+from benchmarks.search import makeQueries, percentile
+
+
+def makeRequests(count: int, distinct: int, seed: int = 2):
+    # users repeat popular searches, so draw from a Zipf-weighted pool of distinct queries
+    rng = random.Random(seed)
+    pool = makeQueries(distinct, seed)
+    weights = [1/(rank + 1) for rank in range(distinct)]
+    requests = []
+    while len(requests) < count:
+        query, size, start, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes = rng.choices(pool, weights)[0]
+        params = [("q", query), ("ps", size), ("sortBy", sortBy), ("shipsTo", shipsTo), ("nsfw", str(nsfw).lower())]
+        params += [("acceptedCurrencies", currency.lower()) for currency in acceptedCurrencies]
+        params += [("contractTypes", contractType.lower()) for contractType in contractTypes]
+        if rng.random() < 0.2:
+            # a user paging through results by following links.next
+            requests.append((params + [("p", 0)], rng.randint(2, 10)))
+        else:
+            page = start//size if rng.random() < 0.9 else rng.choice([10, 25, 50])
+            requests.append((params + [("p", page)], 0))
+    return requests
+
+
+async def get(app, queryString: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/", "raw_path": b"/", "root_path": "", "query_string": queryString.encode("ascii"),
+        "headers": [(b"host", b"benchmark")], "server": ("benchmark", 80), "client": ("127.0.0.1", 0)
+    }
+    body = []
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status[0], b"".join(body)
+
+
+def searchSeconds():
+    histogram = metrics.histograms.get(("elasticsearch_request_seconds", (("operation", "_search"),)))
+    return histogram[1] if histogram is not None else 0.0
+
+
+async def replay(request: tuple, samples: list):
+    params, followPages = request
+    queryString = urllib.parse.urlencode(params)
+    for _ in range(followPages + 1):
+        esBefore = searchSeconds()
+        start = time.perf_counter()
+        status, content = await get(server.app, queryString)
+        elapsed = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError("search returned {} for {}".format(status, queryString))
+        # only meaningful when requests run one at a time
+        esTime = searchSeconds() - esBefore
+        samples.append((elapsed, esTime))
+        nextLink = orjson.loads(content)["links"].get("next")
+        if nextLink is None:
+            break
+        queryString = urllib.parse.urlsplit(nextLink).query
+
+
+async def run(requests: list, concurrency: int):
+    samples = []
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker():
+        while not queue.empty():
+            await replay(queue.get_nowait(), samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return samples, time.perf_counter() - start
+
+
+def report(name: str, samples: list, elapsed: float, split: bool):
+    latencies = [total*1000 for total, _ in samples]
+    print("{:<11} {:>6} requests {:>8.1f} requests/s  total p50 {:>7.2f}ms p95 {:>7.2f}ms p99 {:>7.2f}ms".format(
+        name, len(samples), len(samples)/elapsed, percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99)))
+    if split:
+        esTimes = [esTime*1000 for _, esTime in samples]
+        pythonTimes = [(total - esTime)*1000 for total, esTime in samples]
+        for part, values in (("elasticsearch", esTimes), ("python", pythonTimes)):
+            print("{:>38}  {:<6} p50 {:>7.2f}ms p95 {:>7.2f}ms p99 {:>7.2f}ms".format(
+                part, "", percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)))
+
+
+async def deleteIndices():
+    es = AsyncElasticsearch([os.environ["ELASTICSEARCH_HOST"]])
+    try:
+        await es.indices.delete(index=elastic.READ_ALIAS + "-*", ignore=404)
+    finally:
+        await es.transport.close()
+
+
+async def main():
+    if elastic.READ_ALIAS == "listings":
+        raise SystemExit("set ELASTICSEARCH_INDEX to a scratch index name such as benchmark-listings, its indices are replaced by the corpus")
+    for name, value in [("LISTINGS_URL", "http://benchmark/listings"), ("REPORTS_URL", "http://benchmark/reports"),
+                        ("LOGO_URL", "http://benchmark/logo.png"), ("NAME", "benchmark")]:
+        os.environ.setdefault(name, value)
+
+    loadCorpus = os.environ.get("BENCHMARK_SKIP_LOAD", "false").lower() != "true"
+    if loadCorpus:
+        await deleteIndices()
+    # the app's own startup connects to Elasticsearch and Postgres and creates the aliased index
+    await server.startupEvent()
+    try:
+        if loadCorpus:
+            await corpus.loadCorpus(elastic.es, elastic.WRITE_ALIAS, int(os.environ.get("BENCHMARK_CORPUS_SIZE", 20000)), create=False)
+            await db.bumpIndexVersion()
+        requests = makeRequests(int(os.environ.get("BENCHMARK_REQUESTS", 1000)), int(os.environ.get("BENCHMARK_DISTINCT_QUERIES", 300)))
+        concurrency = int(os.environ.get("BENCHMARK_CONCURRENCY", 16))
+
+        await run(requests[:50], 1)
+        searchcache.entries.clear()
+        searchcache.cursors.clear()
+        samples, elapsed = await run(requests, 1)
+        report("sequential", samples, elapsed, True)
+
+        searchcache.entries.clear()
+        searchcache.cursors.clear()
+        samples, elapsed = await run(requests, concurrency)
+        report("concurrent", samples, elapsed, False)
+        print("search cache:", searchcache.stats())
+    finally:
+        await elastic.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+import tracemalloc
+from copy import deepcopy
+import responses
+
+
+def makeResults(pageSize: int):
+    results = {"total": 10000, "morePages": True, "results": []}
+    for index in range(pageSize):
+        results["results"].append({
+            "type": "listing",
+            "data": {
+                "hash": "zb2rh{:046d}".format(index),
+                "slug": "listing-{}".format(index),
+                "title": "Synthetic listing {}".format(index),
+                "thumbnail": {"tiny": "zb2rhtiny", "small": "zb2rhsmall", "medium": "zb2rhmedium"},
+                "language": "en",
+                "price": {"amount": 1000 + index, "currencyCode": "USD", "modifier": 0},
+                "averageRating": 4.5,
+                "ratingCount": 12,
+                "freeShipping": [],
+                "coinType": "",
+                "nsfw": False
+            },
+            "relationships": {
+                "vendor": {"data": {"peerID": "Qm{:044d}".format(index), "name": "Vendor {}".format(index), "avatarHashes": {"tiny": "zb2rhavatar"}}},
+                "moderators": []
+            }
+        })
+    return results
+
+
+def deepcopyResponse(template: dict, selfLink: str, shipsTo: str, acceptedCurrencies: list, nsfw: bool, contractTypes: list, sortBy: str, results: dict):
+    response = deepcopy(template)
+    response["results"] = results
+
+    for option in response["options"]["shipsTo"]["options"]:
+        if option["value"] == shipsTo:
+            option["checked"] = True
+            break
+
+    for option in response["options"]["acceptedCurrencies"]["options"]:
+        if option["value"] in acceptedCurrencies:
+            option["checked"] = True
+
+    for option in response["options"]["nsfw"]["options"]:
+        if option["value"] == str(nsfw).lower():
+            option["checked"] = True
+            break
+
+    for option in response["options"]["contractTypes"]["options"]:
+        if option["value"] in contractTypes:
+            option["checked"] = True
+
+    response["sortBy"][sortBy]["selected"] = True
+    response["links"]["self"] = selfLink
+    return json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def skeletonResponse(skeleton: dict, selfLink: str, shipsTo: str, acceptedCurrencies: list, nsfw: bool, contractTypes: list, sortBy: str, results: dict):
+    checked = {
+        "shipsTo": {shipsTo},
+        "acceptedCurrencies": set(acceptedCurrencies),
+        "nsfw": {str(nsfw).lower()},
+        "contractTypes": set(contractTypes)
+    }
+    return responses.renderResponse(skeleton, {"self": selfLink}, checked, sortBy, responses.dumps(results))
+
+
+def measure(render, iterations: int):
+    render()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render()
+    latency = (time.perf_counter() - start)/iterations
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency, peak
+
+
+def main():
+    iterations = int(os.environ.get("BENCHMARK_ITERATIONS", 2000))
+    pageSize = int(os.environ.get("BENCHMARK_PAGE_SIZE", 20))
+    with open("responseTemplate.json", encoding="utf-8") as file:
+        template = json.load(file)
+    skeleton = responses.compileTemplate(template)
+    results = makeResults(pageSize)
+    arguments = ("http://localhost/?q=*&ps={}".format(pageSize), "united_kingdom", ["BTC", "BCH"], False, ["physical_good"], "price-asc", results)
+
+    if json.loads(deepcopyResponse(template, *arguments)) != json.loads(skeletonResponse(skeleton, *arguments)):
+        raise AssertionError("skeleton response differs from the deepcopy response")
+
+    for name, render in [("deepcopy template", lambda: deepcopyResponse(template, *arguments)),
+                         ("compiled skeleton", lambda: skeletonResponse(skeleton, *arguments))]:
+        latency, peak = measure(render, iterations)
+        print("{:<18} {:>9.1f} us/request {:>9.1f} KiB peak allocated/request".format(name, latency*10**6, peak/1024))
+
+
+if __name__ == "__main__":
+    main()
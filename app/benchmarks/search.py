@@ -0,0 +1,83 @@
+import asyncio
+import os
+import random
+import time
+from elasticsearch_async import AsyncElasticsearch
+import querybuilder
+from benchmarks import corpus
+
+
+def legacyBody(query: str, size: int, start: int, sortBy: str, shipsTo: str, acceptedCurrencies: list, nsfw: bool, contractTypes: list):
+    body = {
+        "from": start, "size" : size,
+        "_source": ["listingData", "peerData", "moderators", "equivalentBitcoinPrice"],
+        "query": {"bool": {"filter": [{"multi_match": {"query": query, "fields": ["listingData.title^5", "tags^2", "description", "peerData.name"]}}]}},
+        "sort": {"_score": {"order": "desc"}}
+    }
+    if sortBy == "price-asc":
+        body["sort"] = {"equivalentBitcoinPrice": {"order": "asc"}}
+    elif sortBy == "price-desc":
+        body["sort"] = {"equivalentBitcoinPrice": {"order": "desc"}}
+    if shipsTo != "any":
+        body["query"]["bool"]["filter"].append({"bool": {"should": [{"term": {"shipsTo": shipsTo.upper()}}, {"term": {"shipsTo": "ANY"}}]}})
+    if acceptedCurrencies != []:
+        body["query"]["bool"]["filter"].append({"bool": {"should": [{"term": {"acceptedCurrencies": currency.upper()}} for currency in acceptedCurrencies]}})
+    if not nsfw:
+        body["query"]["bool"]["filter"].append({"bool": {"filter": {"term": {"listingData.nsfw": False}}}})
+    if contractTypes != []:
+        body["query"]["bool"]["filter"].append({"bool": {"should": [{"term": {"contractType": contractType.upper()}} for contractType in contractTypes]}})
+    return body
+
+
+def makeQueries(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        queries.append((
+            "*" if rng.random() < 0.3 else " ".join(rng.sample(corpus.WORDS, rng.randint(1, 2))),
+            20,
+            rng.choice([0, 0, 0, 1, 2, 5]) * 20,
+            rng.choice(["relevance", "relevance", "price-asc", "price-desc"]),
+            "any" if rng.random() < 0.5 else rng.choice(corpus.COUNTRIES).lower(),
+            rng.sample(corpus.CURRENCIES, rng.randint(0, 2)),
+            rng.random() < 0.1,
+            rng.sample(corpus.CONTRACT_TYPES, rng.randint(0, 1))
+        ))
+    return queries
+
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction*len(values)))]
+
+
+async def run(es, index: str, buildBody, queries: list):
+    latencies = []
+    tooks = []
+    for arguments in queries:
+        body = buildBody(*arguments)
+        start = time.perf_counter()
+        response = await es.search(index=index, body=body)
+        latencies.append((time.perf_counter() - start)*1000)
+        tooks.append(response["took"])
+    return latencies, tooks
+
+
+async def main():
+    index = os.environ.get("BENCHMARK_INDEX", "benchmark-listings")
+    es = AsyncElasticsearch([os.environ.get("ELASTICSEARCH_HOST", "localhost")])
+    try:
+        if os.environ.get("BENCHMARK_SKIP_LOAD", "false").lower() != "true":
+            await corpus.loadCorpus(es, index, int(os.environ.get("BENCHMARK_CORPUS_SIZE", 20000)))
+        queries = makeQueries(int(os.environ.get("BENCHMARK_QUERIES", 500)))
+        for name, buildBody in [("legacy query", legacyBody), ("querybuilder", querybuilder.buildBody)]:
+            await run(es, index, buildBody, queries[:50])
+            latencies, tooks = await run(es, index, buildBody, queries)
+            print("{:<13} p50 {:>7.2f}ms p99 {:>7.2f}ms (es took p50 {:>4}ms p99 {:>4}ms)".format(
+                name, percentile(latencies, 0.5), percentile(latencies, 0.99), percentile(tooks, 0.5), percentile(tooks, 0.99)))
+    finally:
+        await es.transport.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
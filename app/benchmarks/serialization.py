@@ -0,0 +1,61 @@
+import json
+import os
+import time
+import orjson
+import elastic
+import responses
+from benchmarks.response import makeResults
+
+
+def makeElasticResponse(pageSize: int):
+    hits = []
+    for result in makeResults(pageSize)["results"]:
+        hits.append({
+            "_index": "listings",
+            "_type": "_doc",
+            "_id": result["data"]["hash"],
+            "_score": 1.0,
+            "_source": {
+                "listingData": result["data"],
+                "peerData": result["relationships"]["vendor"]["data"],
+                "moderators": result["relationships"]["moderators"],
+                "equivalentBitcoinPrice": 1234567
+            }
+        })
+    return json.dumps({"took": 3, "timed_out": False, "hits": {"total": {"value": 10000, "relation": "eq"}, "max_score": 1.0, "hits": hits}}).encode("utf-8")
+
+
+def jsonPath(raw: bytes, skeleton: dict, selfLink: str, checked: dict, pageSize: int):
+    results = elastic.buildResults(json.loads(raw)["hits"], 0, pageSize)
+    resultsJSON = json.dumps(results, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return responses.renderResponse(skeleton, {"self": selfLink}, checked, "relevance", resultsJSON)
+
+
+def orjsonPath(raw: bytes, skeleton: dict, selfLink: str, checked: dict, pageSize: int):
+    results = elastic.buildResults(orjson.loads(raw)["hits"], 0, pageSize)
+    return responses.renderResponse(skeleton, {"self": selfLink}, checked, "relevance", responses.dumps(results))
+
+
+def main():
+    iterations = int(os.environ.get("BENCHMARK_ITERATIONS", 2000))
+    pageSize = int(os.environ.get("BENCHMARK_PAGE_SIZE", 100))
+    with open("responseTemplate.json", encoding="utf-8") as file:
+        skeleton = responses.compileTemplate(json.load(file))
+    raw = makeElasticResponse(pageSize)
+    checked = {"shipsTo": {"any"}, "nsfw": {"false"}}
+    selfLink = "http://localhost/?q=*&ps={}".format(pageSize)
+
+    if json.loads(jsonPath(raw, skeleton, selfLink, checked, pageSize)) != json.loads(orjsonPath(raw, skeleton, selfLink, checked, pageSize)):
+        raise AssertionError("orjson response differs from the json response")
+
+    print("ps={}, {} byte Elasticsearch response".format(pageSize, len(raw)))
+    for name, path in [("json", jsonPath), ("orjson", orjsonPath)]:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            path(raw, skeleton, selfLink, checked, pageSize)
+        elapsed = time.perf_counter() - start
+        print("{:<8} {:>9.1f} us/request {:>10.1f} requests/s".format(name, elapsed/iterations*10**6, iterations/elapsed))
+
+
+if __name__ == "__main__":
+    main()
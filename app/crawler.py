@@ -1,8 +1,27 @@
 import asyncio
-import random
 import db
+import log
+import metrics
 import obrequests
-import time
+import os
+import peerhealth
+import pipeline
+import worker
+
+
+KNOWN_PEERS_CACHE = os.environ.get("CRAWLER_KNOWN_PEERS_CACHE", "true").lower() == "true"
+CRAWL_BATCH_SIZE = int(os.environ.get("CRAWLER_BATCH_SIZE", 100))
+RECRAWL_SECONDS = int(os.environ.get("CRAWLER_RECRAWL_SECONDS", 6*3600))
+CRAWL_LEASE_SECONDS = int(os.environ.get("CRAWLER_LEASE_SECONDS", 600))
+YIELD_SMOOTHING = float(os.environ.get("CRAWLER_YIELD_SMOOTHING", 0.5))
+knownPeers = set()
+
+
+async def warmKnownPeers():
+    if KNOWN_PEERS_CACHE:
+        async for peerID in db.iterateAllNewPeers():
+            knownPeers.add(peerID)
+        log.info("known peers cached:", len(knownPeers))
 
 
 async def filterOnlinePeers(peers: list):
@@ -12,92 +31,107 @@ async def filterOnlinePeers(peers: list):
 
 
 async def filterOutImportedPeers(peers: list):
-    peers = await asyncio.gather(*[db.inNewDatabase(peerID) for peerID in peers])
-    peers = [peerID for peerID, inDatabase in peers if not inDatabase]
-    return peers
+    peers = set(peers) - knownPeers
+    if len(peers) == 0:
+        return []
+    inDatabase = await db.getKnownNewPeers(peers)
+    if KNOWN_PEERS_CACHE:
+        knownPeers.update(inDatabase)
+    return list(peers - inDatabase)
+
+
+async def insertNewPeers(peers: list):
+    await db.insertNewPeers(peers)
+    metrics.increment("crawler_new_peers_total", len(peers))
+    if KNOWN_PEERS_CACHE:
+        knownPeers.update(peers)
+
+
+async def insertFrontierPeers(yieldScores: dict):
+    await db.insertFrontierPeers(yieldScores)
+    metrics.increment("crawler_new_peers_total", len(yieldScores))
+    if KNOWN_PEERS_CACHE:
+        knownPeers.update(yieldScores)
 
 
 async def getNewPeers(peers: list):
-    newPeers = await asyncio.gather(*[obrequests.fetchNewPeers(peerID) for peerID in peers])
-    newPeers = [y for x in newPeers for y in x]
-    newPeers = list(set(newPeers))
-    return newPeers
+    neighbours = dict()
 
+    async def fetchNewPeers(peerID: str):
+        peers = await obrequests.fetchNewPeers(peerID)
+        if peers is not None:
+            neighbours[peerID] = peers
+        return None
 
-def getRandomSample(population: list, length: int):
-    if len(population) > length:
-        return random.sample(population, length)
-    else:
-        return population
+    await pipeline.runPipeline("crawl", peers, [("neighbours", fetchNewPeers, pipeline.workerCount("neighbours", 16))])
+    return neighbours
 
 
 async def crawlPass():
-    print("getting all peers from the database...")
-    seedPeers = [peer[0] for peer in await db.getAllNewPeers()]
-    print(len(seedPeers))
+    seedPeers = await db.leaseCrawlFrontier(CRAWL_BATCH_SIZE, RECRAWL_SECONDS, CRAWL_LEASE_SECONDS)
+    log.info("crawl seeds:", len(seedPeers))
+    if len(seedPeers) == 0:
+        return 0, 0
 
     # --- maybe this is not needed --- #
-    #print("getting subset of peers which are online...")
     #seedPeers = await filterOnlinePeers(seedPeers)
-    #print(len(seedPeers))
-
-    print("getting random subset of peers...")
-    seedPeers = getRandomSample(seedPeers, 100)
-    print(len(seedPeers))
-    
-    print("crawling each peer...")
-    newPeers = await getNewPeers(seedPeers)
-    print(len(newPeers))
-    
-    print("geting subset of peers which are not in the database...")
-    newPeers = await filterOutImportedPeers(newPeers)
-    print(len(newPeers))
-    
-    #print("getting subset of peers which are online...")
+
+    neighbours = await getNewPeers(seedPeers)
+    discovered = set(peerID for peers in neighbours.values() for peerID in peers)
+    newPeers = set(await filterOutImportedPeers(discovered))
+
     #newPeers = await filterOnlinePeers(newPeers)
-    #print(len(newPeers))
-    
-    print("inserting the peers into the database...")
-    await db.insertNewPeers(newPeers)
+
+    # a seed's yield is how many unknown peers it led to; its new neighbours inherit the best yield as their priority
+    yields = {seed: len(newPeers.intersection(peers)) for seed, peers in neighbours.items()}
+    yieldScores = dict()
+    for seed, peers in neighbours.items():
+        for peerID in newPeers.intersection(peers):
+            yieldScores[peerID] = max(yieldScores.get(peerID, 0), yields[seed])
+    edges = [(seed, peerID) for seed, peers in neighbours.items() for peerID in set(peers) if peerID != seed]
+
+    await insertFrontierPeers(yieldScores)
+    await db.insertEdges(edges)
+    await db.recordCrawlYields(yields, YIELD_SMOOTHING)
+    await peerhealth.flush()
+    metrics.increment("crawler_seeds_total", len(seedPeers))
+    log.info("crawl pass: {} new of {} neighbours from {}/{} seeds ({:.2f} new per seed), {} edges".format(
+        len(newPeers), len(discovered), len(neighbours), len(seedPeers), len(newPeers)/len(seedPeers), len(edges)))
+    return len(seedPeers), len(newPeers)
+
 
 async def importFollowPeers():
-    print("getting followers and following peers...")
     followPeers = await obrequests.fetchFollowPeers()
-    print(len(followPeers))
+    log.info("followers and following peers:", len(followPeers))
 
-    print("getting subset of peers which are not in the database...")
     followPeers = await filterOutImportedPeers(followPeers)
-    print(len(followPeers))
+    log.info("peers not in the database:", len(followPeers))
 
-    print("getting subset of peers which are online...")
     followPeers = await filterOnlinePeers(followPeers)
-    print(len(followPeers))
+    log.info("peers online:", len(followPeers))
 
-    print("inserting the peers into the database...")
-    await db.insertNewPeers(followPeers)
+    await insertNewPeers(followPeers)
+    await peerhealth.flush()
 
 
 async def importConnectedPeers():
-    print("getting the connected peers...")
     connectedPeers = await obrequests.fetchConnectedPeers()
-    print(len(connectedPeers))
+    log.info("connected peers:", len(connectedPeers))
 
-    print("getting subset of peers which are not in the database...")
     connectedPeers = await filterOutImportedPeers(connectedPeers)
-    print(len(connectedPeers))
+    log.info("peers not in the database:", len(connectedPeers))
+
+    await insertNewPeers(connectedPeers)
+
 
-    print("inserting the peers into the database...")
-    await db.insertNewPeers(connectedPeers)
+async def crawlRound():
+    await importConnectedPeers()
+    await importFollowPeers()
+    await crawlPass()
 
 
 async def crawl():
-    await obrequests.init()
-    await db.init()
-    while True:
-        time.sleep(random.randint(10, 100))
-        await importConnectedPeers()
-        await importFollowPeers()
-        await crawlPass()
+    await worker.run(["crawl"])
 
 
 if __name__ == "__main__":
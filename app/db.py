@@ -1,10 +1,22 @@
 import asyncio
 import asyncpg
-from datetime import datetime
+import contextlib
+from datetime import datetime, timedelta
 import json
 import os
 import time
 import random
+import log
+import metrics
+
+
+# when a peer falls due for an update: bigger shops fall due sooner, a peer with no listings after a day
+# kept identical in the index and the lease query so the planner can walk the index instead of sorting
+UPDATE_DUE = """(COALESCE(LEAST(lastListingUpdate, lastProfileUpdate), TIMESTAMP 'epoch')
+                 + INTERVAL '1 day' / (1 + ln(1 + COALESCE(listingCount, 0))))"""
+# the same for crawling: never crawled peers first, each tier ordered by yield (inherited from the seed that
+# found a new peer), so peers near productive seeds fall due sooner
+CRAWL_DUE = """(COALESCE(lastCrawled, TIMESTAMP 'epoch') + INTERVAL '1 day' / (1 + yieldScore))"""
 
 
 async def init():
@@ -24,11 +36,11 @@ async def init():
                 database=POSTGRESQL_DB,
                 host=POSTGRESQL_HOST)
             connected = True
-            print("connected to postgres")
+            log.info("connected to postgres")
         except:
-            print("unable to connect to postgres, trying again...")
-            time.sleep(random.randint(10,50)/10)
-    time.sleep(random.randint(10,50)/10)
+            log.warning("unable to connect to postgres, trying again...")
+            await asyncio.sleep(random.randint(10,50)/10)
+    await asyncio.sleep(random.randint(10,50)/10)
 
     sql = """CREATE TABLE IF NOT EXISTS reports(peerID TEXT NOT NULL,
                                                 slug TEXT NOT NULL,
@@ -51,156 +63,414 @@ async def init():
                                               profileData JSONB);"""
     async with connectionPool.acquire() as connection:
         await connection.execute(sql)
-    
-    sql = """CREATE TABLE IF NOT EXISTS listings (listingID TEXT PRIMARY KEY,
-                                                  peerID TEXT,
-                                                  equivalentBitcoinPrice BIGINT,
-                                                  lastPriceUpdate TIMESTAMP,
-                                                  currentlyFeatured BOOLEAN,
-                                                  basicListing JSONB,
-                                                  detailedListing JSONB,
-                                                  listingData JSONB);"""
+
+    sql = """ALTER TABLE peers ADD COLUMN IF NOT EXISTS leasedUntil TIMESTAMP;"""
     async with connectionPool.acquire() as connection:
         await connection.execute(sql)
 
-
-async def insertReport(peerID: str, slug: str, reason: str):
-    sql = "INSERT INTO reports (peerID, slug, reason, time) VALUES ($1, $2, $3, $4);"
+    sql = """CREATE INDEX IF NOT EXISTS peersUpdateDue ON peers ({});""".format(UPDATE_DUE)
     async with connectionPool.acquire() as connection:
-        await connection.fetch(sql, peerID, slug, reason, datetime.now())
-
+        await connection.execute(sql)
 
-async def inNewDatabase(peerID: str):
-    sql = "SELECT peerID FROM newPeers WHERE peerID = $1;"
+    sql = """ALTER TABLE newPeers ADD COLUMN IF NOT EXISTS failureCount INT NOT NULL DEFAULT 0,
+                                  ADD COLUMN IF NOT EXISTS coolDownUntil TIMESTAMP;"""
     async with connectionPool.acquire() as connection:
-        result = await connection.fetch(sql, peerID)
-    return [peerID, True] if len(result) > 0 else [peerID, False]
-
-
-async def insertNewPeers(peers: list):
-
-    async def insertNewPeer(peerID: str):
-        try:
-            sql = "INSERT INTO newPeers (peerID) VALUES ($1);"
-            async with connectionPool.acquire() as connection:
-                await connection.execute(sql, peerID)
-            print("peer inserted:", peerID)
-        except asyncpg.exceptions.UniqueViolationError:
-            print("peer already inserted:", peerID)
-    
-    await asyncio.gather(*[insertNewPeer(peerID) for peerID in peers])
+        await connection.execute(sql)
 
+    # a random key per peer lets sampling probe an index range instead of sorting every row
+    sql = """ALTER TABLE newPeers ADD COLUMN IF NOT EXISTS sampleKey DOUBLE PRECISION NOT NULL DEFAULT random();"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-async def insertPeer(peerID: str, profileData: dict, update: bool):
-    try:
-        sql = "INSERT INTO peers (peerID, profileData) VALUES ($1, $2);"
-        async with connectionPool.acquire() as connection:
-            await connection.execute(sql, peerID, json.dumps(profileData))
-        await updateLastProfileUpdate(peerID)
-        print("peer inserted:", peerID)
-    
-    except asyncpg.exceptions.UniqueViolationError:
-        if update:
-            sql = "UPDATE peers SET profileData = $1 WHERE peerID = $2;"
-            async with connectionPool.acquire() as connection:
-                await connection.execute(sql, json.dumps(profileData), peerID)
-            print("peer updated:", peerID)
-    
-    await updateLastProfileUpdate(peerID)
+    sql = """CREATE INDEX IF NOT EXISTS newPeersSampleKey ON newPeers (sampleKey);"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
+    sql = """ALTER TABLE newPeers ADD COLUMN IF NOT EXISTS lastCrawled TIMESTAMP,
+                                  ADD COLUMN IF NOT EXISTS crawlCount INT NOT NULL DEFAULT 0,
+                                  ADD COLUMN IF NOT EXISTS yieldScore REAL NOT NULL DEFAULT 0,
+                                  ADD COLUMN IF NOT EXISTS crawlLeasedUntil TIMESTAMP;"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-async def insertListings(peerID: str, listings: list, update: bool):
+    sql = """DROP INDEX IF EXISTS newPeersCrawlDue;"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-    async def insertListing(peerID: str, listing: dict, update: bool):
-        listingID = listing["hash"]
-        basicListing = listing["basicListing"]
-        detailedListing = listing["detailedListing"]
-        listingData = listing["listingData"]
+    sql = """CREATE INDEX IF NOT EXISTS newPeersCrawlDueByYield ON newPeers ({});""".format(CRAWL_DUE)
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-        try:
-            sql = "INSERT INTO listings (listingID, peerID, basicListing, detailedListing, listingData) VALUES ($1, $2, $3, $4, $5);"
-            async with connectionPool.acquire() as connection:
-                await connection.execute(sql, listingID, peerID, json.dumps(basicListing), json.dumps(detailedListing), json.dumps(listingData))
-            print("listing inserted:", peerID)
-        
-        except asyncpg.exceptions.UniqueViolationError:
-            if update:
-                sql = "UPDATE listings SET basicListing = $1, detailedListing = $2, listingData = $3 WHERE listingID = $4;"
-                async with connectionPool.acquire() as connection:
-                    await connection.execute(sql, json.dumps(basicListing), json.dumps(detailedListing), json.dumps(listingData), listingID)
-                print("listings updated:", peerID)
+    sql = """CREATE TABLE IF NOT EXISTS peerEdges(source TEXT NOT NULL,
+                                                  target TEXT NOT NULL,
+                                                  PRIMARY KEY(source, target));"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
     
-    await asyncio.gather(*[insertListing(peerID, listing, update) for listing in listings])
-    await updateLastListingUpdate(peerID)
-    await updateListingCount(peerID, len(listings))
-
-
-#async def updateLastOnline(peerID: str):  ### dont think this is used but probably should be
-#    sql = "UPDATE peers SET lastOnline = $1 WHERE peerID = $2;"
-#    async with connectionPool.acquire() as connection:
-#        result = await connection.execute(sql, datetime.now(), peerID)
-#    return True if result == "UPDATE 1" else False
-
+    sql = """CREATE TABLE IF NOT EXISTS listings (listingID TEXT PRIMARY KEY,
+                                                  peerID TEXT,
+                                                  equivalentBitcoinPrice BIGINT,
+                                                  lastPriceUpdate TIMESTAMP,
+                                                  currentlyFeatured BOOLEAN,
+                                                  basicListing JSONB,
+                                                  detailedListing JSONB,
+                                                  listingData JSONB);"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-async def updateLastProfileUpdate(peerID: str):
-    sql = "UPDATE peers SET lastProfileUpdate = $1 WHERE peerID = $2;"
+    sql = """CREATE INDEX IF NOT EXISTS listingsPeerID ON listings (peerID);"""
     async with connectionPool.acquire() as connection:
-        result = await connection.execute(sql, datetime.now(), peerID)
-    return True if result == "UPDATE 1" else False
+        await connection.execute(sql)
 
+    # cleared when a listing's Elasticsearch write fails, so the next update of its peer indexes it again
+    sql = """ALTER TABLE listings ADD COLUMN IF NOT EXISTS indexed BOOLEAN NOT NULL DEFAULT true;"""
+    async with connectionPool.acquire() as connection:
+        await connection.execute(sql)
 
-async def updateLastListingUpdate(peerID: str):
-    sql = "UPDATE peers SET lastListingUpdate = $1 WHERE peerID = $2;"
+    sql = """CREATE TABLE IF NOT EXISTS indexVersion(id INT PRIMARY KEY,
+                                                     version BIGINT NOT NULL);"""
     async with connectionPool.acquire() as connection:
-        result = await connection.execute(sql, datetime.now(), peerID)
-    return True if result == "UPDATE 1" else False
+        await connection.execute(sql)
+        await connection.execute("INSERT INTO indexVersion (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;")
 
 
-async def updateListingCount(peerID: str, listingCount: int):
-    sql = "UPDATE peers SET listingCount = $1 WHERE peerID = $2;"
-    async with connectionPool.acquire() as connection:
-        result = await connection.execute(sql, listingCount, peerID)
-    return True if result == "UPDATE 1" else False
+async def close():
+    await connectionPool.close()
 
 
-async def updateBitcoinPrice(listingID: str, equivalentBitcoinPrice: int):
-    sql = "UPDATE listings SET equivalentBitcoinPrice = $1, lastPriceUpdate = $2 WHERE listingID = $3;"
+@contextlib.asynccontextmanager
+async def acquire():
+    start = time.perf_counter()
     async with connectionPool.acquire() as connection:
-        result = await connection.execute(sql, equivalentBitcoinPrice, datetime.now(), listingID)
-    return True if result == "UPDATE 1" else False
-    
+        metrics.observe("db_pool_wait_seconds", time.perf_counter() - start)
+        yield connection
 
-async def getAllPeers():
-    sql = ("SELECT peerID FROM peers;")
-    async with connectionPool.acquire() as connection:
-        peers = await connection.fetch(sql)
-    return peers
 
+@metrics.timed("db_query_seconds")
+async def insertReport(peerID: str, slug: str, reason: str):
+    sql = "INSERT INTO reports (peerID, slug, reason, time) VALUES ($1, $2, $3, $4);"
+    async with acquire() as connection:
+        await connection.fetch(sql, peerID, slug, reason, datetime.now())
 
-async def getAllNewPeers():
-    sql = ("SELECT peerID FROM newPeers;")
-    async with connectionPool.acquire() as connection:
-        peers = await connection.fetch(sql)
-    return peers
+
+@metrics.timed("db_query_seconds")
+async def getKnownNewPeers(peers: list):
+    sql = "SELECT peerID FROM newPeers WHERE peerID = ANY($1::text[]);"
+    async with acquire() as connection:
+        result = await connection.fetch(sql, list(peers))
+    return set(row[0] for row in result)
 
 
+@metrics.timed("db_query_seconds")
+async def insertNewPeers(peers: list):
+    sql = "INSERT INTO newPeers (peerID) VALUES ($1) ON CONFLICT (peerID) DO NOTHING;"
+    async with acquire() as connection:
+        await connection.executemany(sql, [(peerID,) for peerID in peers])
+    metrics.increment("db_new_peers_inserted_total", len(peers))
+    log.debug("peers inserted:", len(peers))
+
+
+@metrics.timed("db_query_seconds")
+async def insertFrontierPeers(yieldScores: dict):
+    sql = """INSERT INTO newPeers (peerID, yieldScore)
+             SELECT * FROM unnest($1::text[], $2::real[])
+             ON CONFLICT (peerID) DO NOTHING;"""
+    async with acquire() as connection:
+        result = await connection.execute(sql, list(yieldScores.keys()), list(yieldScores.values()))
+    metrics.increment("db_new_peers_inserted_total", len(yieldScores))
+    log.debug("frontier peers inserted:", len(yieldScores))
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def insertEdges(edges: list):
+    sql = """INSERT INTO peerEdges (source, target)
+             SELECT * FROM unnest($1::text[], $2::text[])
+             ON CONFLICT DO NOTHING;"""
+    async with acquire() as connection:
+        result = await connection.execute(sql, [source for source, _ in edges], [target for _, target in edges])
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def leaseCrawlFrontier(limit: int, recrawlSeconds: int, leaseSeconds: int):
+    # lastCrawled is only stamped by recordCrawlYields, a crawl that fails just lets its lease run out
+    sql = """UPDATE newPeers SET crawlLeasedUntil = LOCALTIMESTAMP + $3::interval
+             WHERE peerID IN (
+                 SELECT peerID FROM newPeers
+                 WHERE (crawlLeasedUntil IS NULL OR crawlLeasedUntil < LOCALTIMESTAMP)
+                 AND (lastCrawled IS NULL OR lastCrawled < LOCALTIMESTAMP - $2::interval)
+                 AND (coolDownUntil IS NULL OR coolDownUntil < LOCALTIMESTAMP)
+                 ORDER BY {}
+                 LIMIT $1
+                 FOR UPDATE SKIP LOCKED)
+             RETURNING peerID;""".format(CRAWL_DUE)
+    async with acquire() as connection:
+        peers = await connection.fetch(sql, limit, timedelta(seconds=recrawlSeconds), timedelta(seconds=leaseSeconds))
+    return [peer[0] for peer in peers]
+
+
+@metrics.timed("db_query_seconds")
+async def recordCrawlYields(yields: dict, smoothing: float):
+    sql = """UPDATE newPeers SET yieldScore = newPeers.yieldScore * $3 + crawled.found * (1 - $3),
+                                 crawlCount = newPeers.crawlCount + 1,
+                                 lastCrawled = LOCALTIMESTAMP,
+                                 crawlLeasedUntil = NULL
+             FROM unnest($1::text[], $2::int[]) AS crawled(peerID, found)
+             WHERE newPeers.peerID = crawled.peerID;"""
+    async with acquire() as connection:
+        result = await connection.execute(sql, list(yields.keys()), list(yields.values()), smoothing)
+    return int(result.split()[-1])
+
+
+def peerUpsert(update: bool):
+    if update:
+        return """INSERT INTO peers (peerID, profileData, lastProfileUpdate) VALUES ($1, $2, $3)
+                  ON CONFLICT (peerID) DO UPDATE SET profileData = EXCLUDED.profileData,
+                                                     lastProfileUpdate = EXCLUDED.lastProfileUpdate;"""
+    return """INSERT INTO peers (peerID, profileData, lastProfileUpdate) VALUES ($1, $2, $3)
+              ON CONFLICT (peerID) DO UPDATE SET lastProfileUpdate = EXCLUDED.lastProfileUpdate;"""
+
+
+def listingUpsert(update: bool):
+    if update:
+        return """INSERT INTO listings (listingID, peerID, basicListing, detailedListing, listingData) VALUES ($1, $2, $3, $4, $5)
+                  ON CONFLICT (listingID) DO UPDATE SET basicListing = EXCLUDED.basicListing,
+                                                        detailedListing = EXCLUDED.detailedListing,
+                                                        listingData = EXCLUDED.listingData,
+                                                        indexed = true;"""
+    return """INSERT INTO listings (listingID, peerID, basicListing, detailedListing, listingData) VALUES ($1, $2, $3, $4, $5)
+              ON CONFLICT (listingID) DO NOTHING;"""
+
+
+def listingRows(peerID: str, listings: list):
+    return [(listing["hash"],
+             peerID,
+             json.dumps(listing["basicListing"]),
+             json.dumps(listing["detailedListing"]),
+             json.dumps(listing["listingData"])) for listing in listings]
+
+
+async def writeListings(connection, peerID: str, listings: list, update: bool, listingCount: int):
+    await connection.executemany(listingUpsert(update), listingRows(peerID, listings))
+    sql = "UPDATE peers SET lastListingUpdate = $1, listingCount = $2 WHERE peerID = $3;"
+    await connection.execute(sql, datetime.now(), listingCount, peerID)
+
+
+@metrics.timed("db_query_seconds")
+async def insertPeerAndListings(peerID: str, profileData: dict, listings: list, update: bool,
+                                removedListingIDs: list = None, listingCount: int = None):
+    if removedListingIDs is None:
+        removedListingIDs = []
+    if listingCount is None:
+        listingCount = len(listings)
+    async with acquire() as connection:
+        async with connection.transaction():
+            await connection.execute(peerUpsert(update), peerID, json.dumps(profileData), datetime.now())
+            await writeListings(connection, peerID, listings, update, listingCount)
+            if len(removedListingIDs) > 0:
+                sql = "DELETE FROM listings WHERE peerID = $1 AND listingID = ANY($2::text[]);"
+                await connection.execute(sql, peerID, list(removedListingIDs))
+    metrics.increment("db_listings_written_total", len(listings))
+    metrics.increment("db_listings_removed_total", len(removedListingIDs))
+    log.debug("peer and listings inserted:", peerID, len(listings), "removed:", len(removedListingIDs))
+
+
+@metrics.timed("db_query_seconds")
+async def getPeerListingState(peerID: str):
+    async with acquire() as connection:
+        sql = "SELECT profileData FROM peers WHERE peerID = $1;"
+        profileData = await connection.fetchval(sql, peerID)
+        sql = "SELECT listingID, indexed FROM listings WHERE peerID = $1;"
+        listingIDs = await connection.fetch(sql, peerID)
+    profileData = json.loads(profileData) if profileData is not None else None
+    return profileData, set(listingID[0] for listingID in listingIDs), set(listingID[0] for listingID in listingIDs if listingID[1])
+
+
+@metrics.timed("db_query_seconds")
+async def markListingsUnindexed(listingIDs: list):
+    sql = "UPDATE listings SET indexed = false WHERE listingID = ANY($1::text[]);"
+    # clearing the peers' update stamp puts them at the front of the next update pass
+    peersSql = """UPDATE peers SET lastListingUpdate = NULL
+                  WHERE peerID IN (SELECT peerID FROM listings WHERE listingID = ANY($1::text[]));"""
+    async with acquire() as connection:
+        async with connection.transaction():
+            result = await connection.execute(sql, list(listingIDs))
+            await connection.execute(peersSql, list(listingIDs))
+    metrics.increment("db_listings_unindexed_total", int(result.split()[-1]))
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def updateLastOnline(peerIDs: list):
+    sql = "UPDATE peers SET lastOnline = $1 WHERE peerID = ANY($2::text[]);"
+    async with acquire() as connection:
+        result = await connection.execute(sql, datetime.now(), list(peerIDs))
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def recordPeerFailures(peerIDs: list, coolDownBase: float, coolDownMax: float):
+    sql = """UPDATE newPeers SET failureCount = failureCount + 1,
+                                 coolDownUntil = LOCALTIMESTAMP + LEAST($2 * power(2, failureCount), $3) * INTERVAL '1 second'
+             WHERE peerID = ANY($1::text[]);"""
+    async with acquire() as connection:
+        result = await connection.execute(sql, list(peerIDs), coolDownBase, coolDownMax)
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def recordPeerSuccesses(peerIDs: list):
+    sql = """UPDATE newPeers SET failureCount = 0, coolDownUntil = NULL
+             WHERE peerID = ANY($1::text[]) AND failureCount > 0;"""
+    async with acquire() as connection:
+        result = await connection.execute(sql, list(peerIDs))
+    await updateLastOnline(peerIDs)
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def updateBitcoinPrices(prices: list):
+    sql = """UPDATE listings SET equivalentBitcoinPrice = newPrices.equivalentBitcoinPrice, lastPriceUpdate = $3
+             FROM unnest($1::text[], $2::bigint[]) AS newPrices(listingID, equivalentBitcoinPrice)
+             WHERE listings.listingID = newPrices.listingID;"""
+    listingIDs = [listingID for listingID, _ in prices]
+    equivalentBitcoinPrices = [equivalentBitcoinPrice for _, equivalentBitcoinPrice in prices]
+    async with acquire() as connection:
+        result = await connection.execute(sql, listingIDs, equivalentBitcoinPrices, datetime.now())
+    return int(result.split()[-1])
+
+
+@metrics.timed("db_query_seconds")
+async def getRandomUnimportedPeers(limit: int):
+    # walk the sampleKey index from a random point, wrapping around to the start if the tail runs out
+    sql = """SELECT newPeers.peerID FROM newPeers
+             WHERE newPeers.sampleKey >= $2 AND newPeers.sampleKey < $3
+             AND NOT EXISTS (SELECT 1 FROM peers WHERE peers.peerID = newPeers.peerID)
+             AND (newPeers.coolDownUntil IS NULL OR newPeers.coolDownUntil < LOCALTIMESTAMP)
+             ORDER BY newPeers.sampleKey LIMIT $1;"""
+    start = random.random()
+    async with acquire() as connection:
+        peers = await connection.fetch(sql, limit, start, 1.0)
+        if len(peers) < limit:
+            peers += await connection.fetch(sql, limit - len(peers), 0.0, start)
+    return [peer[0] for peer in peers]
+
+
+@metrics.timed("db_query_seconds")
+async def leaseStalestPeers(limit: int, leaseSeconds: int):
+    sql = """UPDATE peers SET leasedUntil = LOCALTIMESTAMP + $2::interval
+             WHERE peerID IN (
+                 SELECT peerID FROM peers
+                 WHERE (leasedUntil IS NULL OR leasedUntil < LOCALTIMESTAMP)
+                 AND NOT EXISTS (SELECT 1 FROM newPeers WHERE newPeers.peerID = peers.peerID
+                                 AND newPeers.coolDownUntil > LOCALTIMESTAMP)
+                 ORDER BY {}
+                 LIMIT $1
+                 FOR UPDATE SKIP LOCKED)
+             RETURNING peerID;""".format(UPDATE_DUE)
+    async with acquire() as connection:
+        peers = await connection.fetch(sql, limit, timedelta(seconds=leaseSeconds))
+    return [peer[0] for peer in peers]
+
+
+@metrics.timed("db_query_seconds")
+async def bumpIndexVersion():
+    sql = "UPDATE indexVersion SET version = version + 1 WHERE id = 1 RETURNING version;"
+    async with acquire() as connection:
+        version = await connection.fetchval(sql)
+    return version
+
+
+@metrics.timed("db_query_seconds")
+async def getIndexVersion():
+    sql = "SELECT version FROM indexVersion WHERE id = 1;"
+    async with acquire() as connection:
+        version = await connection.fetchval(sql)
+    return version
+
+
+CURSOR_PREFETCH = int(os.environ.get("POSTGRESQL_CURSOR_PREFETCH", 500))
+
+
+async def iterate(sql: str, *args, prefetch: int = None, query: str = "iterate"):
+    # only the time spent inside Postgres counts, not the time the caller spends between rows
+    rows = 0
+    querySeconds = 0.0
+    start = time.perf_counter()
+    try:
+        async with acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor(sql, *args, prefetch=prefetch or CURSOR_PREFETCH):
+                    querySeconds += time.perf_counter() - start
+                    start = None
+                    rows += 1
+                    yield row
+                    start = time.perf_counter()
+    except Exception:
+        metrics.increment("db_query_errors_total", function=query)
+        raise
+    finally:
+        if start is not None:
+            querySeconds += time.perf_counter() - start
+        metrics.observe("db_query_seconds", querySeconds, function=query)
+    metrics.increment("db_rows_streamed_total", rows, function=query)
+
+
+async def iterateIndexableListings(prefetch: int = None):
+    sql = """SELECT listings.listingID, listings.peerID, listings.basicListing, listings.detailedListing,
+                    listings.equivalentBitcoinPrice, peers.profileData
+             FROM listings JOIN peers ON peers.peerID = listings.peerID;"""
+    async for row in iterate(sql, prefetch=prefetch, query="iterateIndexableListings"):
+        yield row
+
+
+async def iterateListingsChangedSince(since: datetime, prefetch: int = None):
+    # peerChanged rows may have lost listings or changed peer data, the rest only changed price
+    sql = """SELECT listings.listingID, listings.peerID, listings.basicListing, listings.detailedListing,
+                    listings.equivalentBitcoinPrice, peers.profileData,
+                    COALESCE(peers.lastListingUpdate >= $1 OR peers.lastProfileUpdate >= $1, false) AS peerChanged
+             FROM listings JOIN peers ON peers.peerID = listings.peerID
+             WHERE peers.lastListingUpdate >= $1 OR peers.lastProfileUpdate >= $1 OR listings.lastPriceUpdate >= $1;"""
+    async for row in iterate(sql, since, prefetch=prefetch, query="iterateListingsChangedSince"):
+        yield row
+
+
+@metrics.timed("db_query_seconds")
+async def getPeersChangedSince(since: datetime):
+    sql = "SELECT peerID FROM peers WHERE lastListingUpdate >= $1 OR lastProfileUpdate >= $1;"
+    async with acquire() as connection:
+        peers = await connection.fetch(sql, since)
+    return [peer[0] for peer in peers]
+
+
+async def iterateListingPrices(prefetch: int = None):
+    sql = """SELECT listingID,
+                    detailedListing->'metadata'->>'pricingCurrency' AS pricingCurrency,
+                    detailedListing->'item'->>'price' AS price,
+                    equivalentBitcoinPrice
+             FROM listings;"""
+    async for row in iterate(sql, prefetch=prefetch, query="iterateListingPrices"):
+        yield row
+
+
+async def iterateAllNewPeers(prefetch: int = None):
+    async for row in iterate("SELECT peerID FROM newPeers;", prefetch=prefetch, query="iterateAllNewPeers"):
+        yield row[0]
+
+
+@metrics.timed("db_query_seconds")
 async def countPeers():
     sql = ("SELECT count(*) FROM peers;")
-    async with connectionPool.acquire() as connection:
+    async with acquire() as connection:
         response = await connection.fetch(sql)
     return response
 
 
+@metrics.timed("db_query_seconds")
 async def countListings():
     sql = ("SELECT count(*) FROM listings;")
-    async with connectionPool.acquire() as connection:
-        response = await connection.fetch(sql)
-    return response
-
-
-async def getNewReports():
-    sql = ("SELECT * FROM reports;")
-    async with connectionPool.acquire() as connection:
+    async with acquire() as connection:
         response = await connection.fetch(sql)
     return response
 
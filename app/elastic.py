@@ -1,129 +1,396 @@
 import asyncio
-from elasticsearch_async import AsyncElasticsearch
+import base64
+from elasticsearch_async import AsyncElasticsearch, AsyncTransport
+from elasticsearch.serializer import JSONSerializer
 import elasticsearch.exceptions
+import json
 import time
 import os
 import logging
+import log
+import metrics
+import orjson
+import querybuilder
 import random
 
 
+class OrjsonSerializer(JSONSerializer):
+
+    def loads(self, s):
+        return orjson.loads(s)
+
+
+class TimedTransport(AsyncTransport):
+
+    def perform_request(self, method, url, *args, **kwargs):
+        return asyncio.ensure_future(timeRequest(url, super().perform_request(method, url, *args, **kwargs)))
+
+
+def requestOperation(url: str):
+    segments = [segment for segment in url.split("?")[0].split("/") if segment != ""]
+    operations = [segment for segment in segments if segment.startswith("_")]
+    if len(operations) > 0:
+        return operations[0]
+    return "index" if len(segments) > 0 else "ping"
+
+
+async def timeRequest(url: str, request):
+    with metrics.timer("elasticsearch_request_seconds", operation=requestOperation(url)):
+        return await request
+
+
+LISTINGS_MAPPING = {
+    "mappings": {
+        "properties": {
+            "listingID": {"type": "keyword"},
+            "peerID": {"type": "keyword"},
+            "description": {"type": "text"},
+            "tags": {"type": "text"},
+            "categories": {"type": "text"},
+            "equivalentBitcoinPrice": {"type": "long"},
+            "contractType": {"type": "keyword"},
+            "language": {"type": "keyword"},
+            "shipsTo": {"type": "keyword"},
+            "condition": {"type": "keyword"},
+            "acceptedCurrencies": {"type": "keyword"},
+            "moderators": {"type": "keyword"},
+            "peerData": {
+                "properties": {
+                    "peerID": {"type": "keyword"},
+                    "name": {"type": "text"},
+                    "avatarHashes": {
+                        "properties": {
+                            "tiny" : {"type": "keyword"}
+                        }
+                    }
+                }
+            },
+            "listingData": {
+                "properties": {
+                    "hash": {"type": "keyword"},
+                    "slug": {"type": "keyword"},
+                    "title": {"type": "text"},
+                    "thumbnail": {
+                        "properties": {
+                            "small": {"type": "keyword"}
+                        }
+                    },
+                    "price": {
+                        "properties": {
+                            "amount": {"type": "long"},
+                            "currencyCode": {"type": "keyword"},
+                            "modifier": {"type": "float"}
+                        }
+                    },
+                    "coinType": {"type": "keyword"},
+                    "nsfw": {"type": "boolean"},
+                    "averageRating": {"type": "float"},
+                    "ratingCount": {"type": "integer"},
+                    "freeShipping": {"type": "keyword"}
+                }
+            }
+        }
+    }
+}
+
+
+READ_ALIAS = os.environ.get("ELASTICSEARCH_INDEX", "listings")
+WRITE_ALIAS = READ_ALIAS + "-write"
+INDEX_SHARDS = int(os.environ.get("ELASTICSEARCH_SHARDS", 1))
+INDEX_REPLICAS = int(os.environ.get("ELASTICSEARCH_REPLICAS", 0))
+INDEX_REFRESH_INTERVAL = os.environ.get("ELASTICSEARCH_REFRESH_INTERVAL", "1s")
+KEEP_OLD_INDICES = os.environ.get("ELASTICSEARCH_KEEP_OLD_INDICES", "false").lower() == "true"
+
+
+def buildIndexTemplate():
+    return {
+        "index_patterns": [READ_ALIAS + "-*"],
+        "settings": {
+            "number_of_shards": INDEX_SHARDS,
+            "number_of_replicas": INDEX_REPLICAS,
+            "refresh_interval": INDEX_REFRESH_INTERVAL
+        },
+        "mappings": LISTINGS_MAPPING["mappings"]
+    }
+
+
 async def init():
 
     ELASTICSEARCH_HOST = os.environ["ELASTICSEARCH_HOST"]
 
-    global es
+    global es, bulkBuffer, bulkBytes, bulkLock, bulkFlusher, bulkActionTotal, activePasses, failedListingIDs
     logging.getLogger('elasticsearch').level = logging.ERROR
-    es = AsyncElasticsearch([ELASTICSEARCH_HOST])
+    es = AsyncElasticsearch([ELASTICSEARCH_HOST], serializer=OrjsonSerializer(), transport_class=TimedTransport)
+    bulkBuffer = []
+    bulkBytes = 0
+    bulkLock = asyncio.Lock()
+    bulkFlusher = None
+    bulkActionTotal = 0
+    activePasses = 0
+    failedListingIDs = set()
 
     connected = False
     while not connected:
         try:
             await es.ping()
             connected = True
-            print("connected to elasticsearch")
+            log.info("connected to elasticsearch")
         except:
-            print("cannot connect to elasticsearch at {}, trying again...".format(ELASTICSEARCH_HOST))
-            time.sleep(random.randint(10,50)/10)
-    time.sleep(random.randint(10,50)/10)
+            log.warning("cannot connect to elasticsearch at {}, trying again...".format(ELASTICSEARCH_HOST))
+            await asyncio.sleep(random.randint(10,50)/10)
+    await asyncio.sleep(random.randint(10,50)/10)
 
-    body = {
-        "mappings": {
-            "properties": {
-                "listingID": {"type": "keyword"},
-                "peerID": {"type": "keyword"},
-                "description": {"type": "text"},
-                "tags": {"type": "text"},
-                "categories": {"type": "text"},
-                "equivalentBitcoinPrice": {"type": "long"},
-                "contractType": {"type": "keyword"},
-                "language": {"type": "keyword"},
-                "shipsTo": {"type": "keyword"},
-                "condition": {"type": "keyword"},
-                "acceptedCurrencies": {"type": "keyword"},
-                "moderators": {"type": "keyword"},
-                "peerData": {
-                    "properties": {
-                        "peerID": {"type": "keyword"},
-                        "name": {"type": "text"},
-                        "avatarHashes": {
-                            "properties": {
-                                "tiny" : {"type": "keyword"}
-                            }
-                        }
-                    }
-                },
-                "listingData": {
-                    "properties": {
-                        "hash": {"type": "keyword"},
-                        "slug": {"type": "keyword"},
-                        "title": {"type": "text"},
-                        "thumbnail": {
-                            "properties": {
-                                "small": {"type": "keyword"}
-                            }
-                        },
-                        "price": {
-                            "properties": {
-                                "amount": {"type": "long"},
-                                "currencyCode": {"type": "keyword"},
-                                "modifier": {"type": "float"}
-                            }
-                        },
-                        "coinType": {"type": "keyword"},
-                        "nsfw": {"type": "boolean"},
-                        "averageRating": {"type": "float"},
-                        "ratingCount": {"type": "integer"},
-                        "freeShipping": {"type": "keyword"}
-                    }
-                }
-            }
-        }
-    }
+    await es.indices.put_template(name=READ_ALIAS, body=buildIndexTemplate())
+    if not await es.indices.exists(index=READ_ALIAS):
+        await es.indices.create(index=READ_ALIAS + "-1", body={"aliases": {READ_ALIAS: {}, WRITE_ALIAS: {}}}, ignore=400)
+        log.info("index created", READ_ALIAS + "-1")
+    elif not await es.indices.exists_alias(name=WRITE_ALIAS):
+        await es.indices.put_alias(index=READ_ALIAS, name=WRITE_ALIAS)
+        log.info("write alias added to", READ_ALIAS)
+
+
+async def getAliasIndices(alias: str):
+    response = await es.indices.get_alias(name=alias, ignore=404)
+    if response.get("status") == 404:
+        return []
+    return list(response.keys())
+
+
+async def isLegacyIndex():
+    return await es.indices.exists(index=READ_ALIAS) and not await es.indices.exists_alias(name=READ_ALIAS)
 
-    await es.indices.create(index='listings', body=body, ignore=400)
+
+async def createVersionedIndex():
+    indices = await es.cat.indices(index=READ_ALIAS + "-*", h="index", format="json")
+    versions = [int(index["index"].rsplit("-", 1)[1]) for index in indices if index["index"].rsplit("-", 1)[1].isdigit()]
+    indexName = "{}-{}".format(READ_ALIAS, max(versions, default=0) + 1)
+    await es.indices.create(index=indexName, body={"settings": {"refresh_interval": "-1"}})
+    log.info("index created", indexName)
+    return indexName
+
+
+async def pointAlias(alias: str, indexName: str):
+    actions = [{"remove": {"index": oldIndex, "alias": alias}} for oldIndex in await getAliasIndices(alias) if oldIndex != indexName]
+    if alias == READ_ALIAS and await isLegacyIndex():
+        actions.append({"remove_index": {"index": READ_ALIAS}})
+    actions.append({"add": {"index": indexName, "alias": alias}})
+    await es.indices.update_aliases(body={"actions": actions})
+    log.info("alias", alias, "now points to", indexName)
+
+
+async def deletePeerListings(indexName: str, peerIDs: list, batchSize: int = 1000):
+    for batchStart in range(0, len(peerIDs), batchSize):
+        body = {"query": {"terms": {"peerID": peerIDs[batchStart:batchStart + batchSize]}}}
+        await es.delete_by_query(index=indexName, body=body, conflicts="proceed", refresh=True)
+
+
+async def deleteIndices(indexNames: list):
+    for indexName in indexNames:
+        await es.indices.delete(index=indexName, ignore=404)
+        log.info("index deleted", indexName)
 
 
 async def close():
-    await es.transport.close()
+    try:
+        await drainBulk()
+    finally:
+        await es.transport.close()
+
+
+BULK_MAX_ACTIONS = int(os.environ.get("ELASTICSEARCH_BULK_ACTIONS", 500))
+BULK_MAX_BYTES = int(os.environ.get("ELASTICSEARCH_BULK_BYTES", 5*1024*1024))
+BULK_FLUSH_INTERVAL = float(os.environ.get("ELASTICSEARCH_BULK_INTERVAL", 5))
+PASS_REFRESH_INTERVAL = os.environ.get("ELASTICSEARCH_PASS_REFRESH_INTERVAL", "30s")
+BULK_RETRIES = int(os.environ.get("ELASTICSEARCH_BULK_RETRIES", 3))
+
+
+async def queueBulkAction(action: dict, source: dict = None):
+    global bulkBytes
+    lines = json.dumps(action) + "\n"
+    if source is not None:
+        lines += json.dumps(source) + "\n"
+    bulkBuffer.append((lines, 0))
+    bulkBytes += len(lines)
+    if len(bulkBuffer) >= BULK_MAX_ACTIONS or bulkBytes >= BULK_MAX_BYTES:
+        await flushBulk()
+
+
+def takeFailedListingIDs():
+    # listings whose index or update action failed since the last call, for the caller to mark in Postgres
+    global failedListingIDs
+    listingIDs, failedListingIDs = failedListingIDs, set()
+    return listingIDs
+
+
+def requeueBulk(batch: list):
+    # put actions back in front of anything queued since, so they go out with the next flush
+    global bulkBuffer, bulkBytes
+    bulkBuffer = batch + bulkBuffer
+    bulkBytes += sum(len(lines) for lines, _ in batch)
+
+
+async def flushBulk():
+    global bulkBuffer, bulkBytes, bulkActionTotal
+    async with bulkLock:
+        if len(bulkBuffer) == 0:
+            return []
+        batch = bulkBuffer
+        bulkBuffer = []
+        bulkBytes = 0
+        try:
+            response = await es.bulk(body="".join(lines for lines, _ in batch))
+        except BaseException:
+            requeueBulk(batch)
+            raise
+        bulkActionTotal += len(batch)
+
+    failures = []
+    retries = []
+    for (lines, attempts), item in zip(batch, response["items"]):
+        operation, result = next(iter(item.items()))
+        if operation == "create" and result.get("status") == 409:
+            continue
+        if result.get("status") == 429 and attempts < BULK_RETRIES:
+            retries.append((lines, attempts + 1))
+            continue
+        if "error" in result:
+            failures.append(item)
+            if operation != "delete":
+                failedListingIDs.add(result.get("_id"))
+            log.every(10, ("bulk", operation), "bulk", operation, "failed:", result.get("_id"), result["error"])
+    requeueBulk(retries)
+    metrics.increment("elasticsearch_bulk_actions_total", len(batch))
+    metrics.increment("elasticsearch_bulk_retries_total", len(retries))
+    metrics.increment("elasticsearch_bulk_failures_total", len(failures))
+    log.debug("bulk flushed:", len(batch), "actions,", len(retries), "retried,", len(failures), "failures")
+    return failures
+
+
+async def drainBulk():
+    # rejected actions wait in the buffer for a retry, give them their attempts before a pass ends
+    failures = []
+    for attempt in range(BULK_RETRIES + 1):
+        failures += await flushBulk()
+        if len(bulkBuffer) == 0:
+            break
+        await asyncio.sleep(min(BULK_FLUSH_INTERVAL, 0.5*2**attempt))
+    return failures
+
+
+async def flushBulkPeriodically():
+    while True:
+        await asyncio.sleep(BULK_FLUSH_INTERVAL)
+        try:
+            await flushBulk()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exception:
+            log.every(10, "bulk flush", "periodic bulk flush failed, keeping", len(bulkBuffer), "actions:", exception)
+
+
+async def startBulkPass():
+    # passes can overlap (import and update share a worker), the first one in sets up the flusher and
+    # the pass refresh interval and the last one out restores them, each pass keeps its own start
+    global bulkFlusher, activePasses
+    activePasses += 1
+    if activePasses == 1:
+        try:
+            await es.indices.put_settings(index=WRITE_ALIAS, body={"index": {"refresh_interval": PASS_REFRESH_INTERVAL}})
+        except BaseException:
+            activePasses -= 1
+            raise
+        bulkFlusher = asyncio.ensure_future(flushBulkPeriodically())
+    return bulkActionTotal + len(bulkBuffer)
+
+
+async def finishBulkPass(passStart: int):
+    # the count includes actions flushed for overlapping passes, so it can only over report
+    global bulkFlusher, activePasses
+    activePasses -= 1
+    if activePasses == 0 and bulkFlusher is not None:
+        bulkFlusher.cancel()
+        bulkFlusher = None
+    try:
+        await drainBulk()
+    finally:
+        if activePasses == 0:
+            await es.indices.put_settings(index=WRITE_ALIAS, body={"index": {"refresh_interval": INDEX_REFRESH_INTERVAL}})
+    passActions = bulkActionTotal - passStart
+    if passActions > 0 and activePasses == 0:
+        await es.indices.refresh(index=WRITE_ALIAS)
+    return passActions
+
+
+def buildPeerData(peerID: str, fullPeerData: dict):
+    return {
+        "peerID": peerID,
+        "name": str(fullPeerData["name"]),
+        "avatarHashes": dict(fullPeerData.get("avatarHashes", {}))
+    }
+
+
+def buildDocument(peerID: str, listing: dict, fullPeerData: dict):
+    return {
+        "listingID": str(listing["hash"]),
+        "peerID": peerID,
+        "description": str(listing["description"]),
+        "tags": list(listing["tags"]),
+        "categories": list(listing["categories"]),
+        "equivalentBitcoinPrice": 0,
+        "contractType": str(listing["contractType"]),
+        "language": str(listing["language"]),
+        "shipsTo": list(listing["shipsTo"]),
+        "condition": str(listing["condition"]),
+        "acceptedCurrencies": list(listing["acceptedCurrencies"]),
+        "moderators": list(listing["moderators"]),
+        "listingData": dict(listing["listingData"]),
+        "peerData": buildPeerData(peerID, fullPeerData)
+    }
 
 
 async def indexListings(peerID: str, listings: list, fullPeerData: dict):
+    for listing in listings:
+        body = buildDocument(peerID, listing, fullPeerData)
+        await queueBulkAction({"index": {"_index": WRITE_ALIAS, "_id": body["listingID"]}}, body)
+    log.debug("queued listings:", peerID, len(listings))
 
-    async def indexListing(peerID: str, listing: dict, fullPeerData: dict):
-        listingID = str(listing["hash"])
-        body = {
-            "listingID": listingID,
-            "peerID": peerID,
-            "description": str(listing["description"]),
-            "tags": list(listing["tags"]),
-            "categories": list(listing["categories"]),
-            "equivalentBitcoinPrice": 0,
-            "contractType": str(listing["contractType"]),
-            "language": str(listing["language"]),
-            "shipsTo": list(listing["shipsTo"]),
-            "condition": str(listing["condition"]),
-            "acceptedCurrencies": list(listing["acceptedCurrencies"]),
-            "moderators": list(listing["moderators"]),
-            "listingData": dict(listing["listingData"]),
-            "peerData": {
-                "peerID": peerID,
-                "name": str(fullPeerData["name"]),
-                "avatarHashes": dict(fullPeerData.get("avatarHashes", {}))
-            }
-        }
 
-        response = await es.index(index="listings", id=listingID, body=body)   
-        print("index", response["result"], listingID)
+async def updatePeerData(peerID: str, listingIDs: list, fullPeerData: dict):
+    body = {"doc": {"peerData": buildPeerData(peerID, fullPeerData)}}
+    for listingID in listingIDs:
+        await queueBulkAction({"update": {"_index": WRITE_ALIAS, "_id": listingID}}, body)
+    log.debug("queued peer data updates:", peerID, len(listingIDs))
 
-    await asyncio.gather(*[indexListing(peerID, listing, fullPeerData) for listing in listings])
-    print("indexed listings:", peerID)
+
+async def deleteListings(listingIDs: list):
+    for listingID in listingIDs:
+        await queueBulkAction({"delete": {"_index": WRITE_ALIAS, "_id": listingID}})
+    log.debug("queued listing deletions:", len(listingIDs))
 
 
 async def updateBitcoinPrice(listingID: str, equivalentBitcoinPrice: int):
     body = {
         "doc": {"equivalentBitcoinPrice": int(equivalentBitcoinPrice)}
     }
-    await es.update(index="listings", id=listingID, body=body)#, ignore=400)
+    await queueBulkAction({"update": {"_index": WRITE_ALIAS, "_id": listingID}}, body)
+
+
+SEARCH_FILTER_PATH = ["hits.total.value", "hits.hits._source", "hits.hits.sort", "aggregations.*.values.buckets"]
+MAX_RESULT_WINDOW = int(os.environ.get("ELASTICSEARCH_MAX_RESULT_WINDOW", 10000))
+
+
+def encodeCursor(pageNumber: int, searchAfter: list):
+    return base64.urlsafe_b64encode(orjson.dumps([pageNumber, searchAfter])).decode("ascii")
+
+
+def decodeCursor(cursor: str):
+    try:
+        pageNumber, searchAfter = orjson.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, UnicodeEncodeError):
+        return None
+    if type(pageNumber) != int or type(searchAfter) != list:
+        return None
+    return pageNumber, searchAfter
 
 
 async def search(query: str,
@@ -133,99 +400,99 @@ async def search(query: str,
                  shipsTo: str,
                  acceptedCurrencies: list,
                  nsfw: bool,
-                 contractTypes: list):
+                 contractTypes: list,
+                 searchAfter: list = None,
+                 facets: bool = False):
 
-    body = {
-        "from": start, "size" : size,
-        "_source": ["listingData", "peerData", "moderators", "equivalentBitcoinPrice"],
-        "query": {
-            "bool": {
-                "filter": [
-                    {
-                        "multi_match": {
-                            "query": query,
-                            "fields": ["listingData.title^5", "tags^2", "description", "peerData.name"]
-                        }
-                    }
-                ]
-            }
-        },
-        "sort": {"_score": {"order": "desc"}}
-    }
+    body = querybuilder.buildBody(query, size, start, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes, searchAfter, facets)
+    response = await es.search(index=READ_ALIAS, body=body, filter_path=SEARCH_FILTER_PATH)
+    return response
 
-    if sortBy == "relevance":
-        pass
-    elif sortBy == "price-asc":
-        body["sort"] = {"equivalentBitcoinPrice": {"order": "asc"}}
-    elif sortBy == "price-desc":
-        body["sort"] = {"equivalentBitcoinPrice": {"order": "desc"}}
-    else:
-        pass
-
-    if shipsTo == "any":
-        pass
-    else:
-        shipsToOption = {
-            "bool": {
-                "should": [
-                    {"term": {"shipsTo": shipsTo.upper()}},
-                    {"term": {"shipsTo": "ANY"}}
-                ]
-            }
-        }
-        body["query"]["bool"]["filter"].append(shipsToOption)
 
-    if acceptedCurrencies != []:   
-        acceptedCurrenciesOption = {"bool": {"should": []}}
-        for acceptedCurrency in acceptedCurrencies:
-            acceptedCurrencyOption = {"term": {"acceptedCurrencies": acceptedCurrency.upper()}}
-            acceptedCurrenciesOption["bool"]["should"].append(acceptedCurrencyOption)
-        body["query"]["bool"]["filter"].append(acceptedCurrenciesOption)
+def pastResultWindow(pageSize: int, pageNumber: int, searchAfter: list = None):
+    # from/size cannot reach past the window, only a search_after cursor can
+    return searchAfter is None and (pageNumber+1)*pageSize > MAX_RESULT_WINDOW
 
-    if not nsfw:
-        nsfwOption = {"bool": {"filter": {"term": {"listingData.nsfw": False}}}}
-        body["query"]["bool"]["filter"].append(nsfwOption)
 
-    if contractTypes != []:   
-        contractTypesOption = {"bool": {"should": []}}
-        for contractType in contractTypes:
-            contractTypeOption = {"term": {"contractType": contractType.upper()}}
-            contractTypesOption["bool"]["should"].append(contractTypeOption)
-        body["query"]["bool"]["filter"].append(contractTypesOption)
+async def getResults(query: str,
+                     pageSize: int,
+                     pageNumber: int,
+                     sortBy: str,
+                     shipsTo: str,
+                     acceptedCurrencies: list,
+                     nsfw: bool,
+                     contractTypes: list,
+                     searchAfter: list = None,
+                     facets: bool = False):
 
-    response = await es.search(index="listings", body=body)
-    return response["hits"]
+    start = pageNumber*pageSize
+    if pastResultWindow(pageSize, pageNumber, searchAfter):
+        raise ValueError("page {} of {} results is past the first {} results without a cursor".format(pageNumber, pageSize, MAX_RESULT_WINDOW))
+    response = await search(query, pageSize, start, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes, searchAfter, facets)
+    elasticResults = response["hits"]
+    hits = elasticResults.get("hits", [])
+    lastSort = hits[-1].get("sort") if len(hits) > 0 else None
+    return buildResults(elasticResults, start, pageSize), lastSort, buildFacets(response) if facets else None
 
 
-async def getSearchResults(response: dict,
-                           query: str,
-                           pageSize: int,
-                           pageNumber: int,
-                           sortBy: str,
-                           shipsTo: str,
-                           acceptedCurrencies: list,
-                           nsfw: bool,
-                           contractTypes: list):
-    
-    start = pageNumber*pageSize
-    elasticResults = await search(query, pageSize, start, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes)
+async def getFacets(query: str,
+                    shipsTo: str,
+                    acceptedCurrencies: list,
+                    nsfw: bool,
+                    contractTypes: list):
+
+    response = await search(query, 0, 0, "relevance", shipsTo, acceptedCurrencies, nsfw, contractTypes, facets=True)
+    return buildFacets(response)
+
+
+def buildFacets(response: dict):
+    facets = dict()
+    for name, aggregation in response.get("aggregations", {}).items():
+        values = dict()
+        for bucket in aggregation["values"]["buckets"]:
+            if name == "nsfw":
+                value = "true" if bucket["key"] else "false"
+            elif name == "acceptedCurrencies":
+                value = str(bucket["key"])
+            else:
+                value = str(bucket["key"]).lower()
+            values[value] = bucket["doc_count"]
+        facets[name] = values
+    return facets
+
+
+def buildResults(elasticResults: dict, start: int, pageSize: int):
     results = {
         "total": elasticResults["total"]["value"],
         "morePages": True if start+pageSize < elasticResults["total"]["value"] else False,
         "results": []
     }
     
-    for hit in elasticResults["hits"]:
+    for hit in elasticResults.get("hits", []):
+        source = hit["_source"]
         result = {
             "type": "listing",
-            "data": hit["_source"]["listingData"],
+            "data": source["listingData"],
             "relationships": {
-                "vendor": {"data": hit["_source"]["peerData"]},
-                "moderators": hit["_source"]["moderators"]
+                "vendor": {"data": source["peerData"]},
+                "moderators": source["moderators"]
             }
         }
         results["results"].append(result)
-    response["results"] = results
+    return results
+
+
+async def getSearchResults(response: dict,
+                           query: str,
+                           pageSize: int,
+                           pageNumber: int,
+                           sortBy: str,
+                           shipsTo: str,
+                           acceptedCurrencies: list,
+                           nsfw: bool,
+                           contractTypes: list):
+
+    response["results"], _, _ = await getResults(query, pageSize, pageNumber, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes)
     return response
 
 
@@ -1,68 +1,118 @@
 import asyncio
-import random
-import json
-import time
 import db
 import obrequests
 import elastic
+import log
+import peerhealth
+import pipeline
+import rates
 import updater
+import worker
 
 
-def getRandomSample(population: list, length: int):
-    if len(population) > length:
-        return random.sample(population, length)
-    else:
-        return population
+async def priceListings(listings: list):
+    prices = []
+    for listing in listings:
+        pricingCurrency = str(listing["detailedListing"]["metadata"]["pricingCurrency"])
+        price = float(listing["detailedListing"]["item"]["price"])
+        if pricingCurrency != "":
+            bitcoinPrice = await rates.convertToSatoshis(pricingCurrency, price)
+            if bitcoinPrice is not None:
+                prices.append((str(listing["hash"]), bitcoinPrice))
 
+    for listingID, bitcoinPrice in prices:
+        await elastic.updateBitcoinPrice(listingID, bitcoinPrice)
+    if len(prices) > 0:
+        await db.updateBitcoinPrices(prices)
 
-async def updateBitcoinPrice(listing: dict):
-    with open("currencyExponents.json") as file:
-        currencyExponents = json.load(file)
 
-    pricingCurrency = str(listing["detailedListing"]["metadata"]["pricingCurrency"])
-    price = float(listing["detailedListing"]["item"]["price"])
-    listingID = str(listing["hash"])
+async def fetchPeerProfile(peer: dict):
+    profileData = await obrequests.fetchProfile(peer["peerID"])
+    if type(profileData) == dict:
+        peer["profileData"] = profileData
+        return peer
+    return None
 
-    if pricingCurrency != "":
-        price = price*(10**(-1*int(currencyExponents[pricingCurrency])))
-        bitcoinPrice = await obrequests.getBitcoinPrice(pricingCurrency, price)
-        if type(bitcoinPrice) == float:
-            bitcoinPrice = int(bitcoinPrice*(10**8))
-            await elastic.updateBitcoinPrice(listingID, bitcoinPrice)
-            await db.updateBitcoinPrice(listingID, bitcoinPrice)
 
+async def fetchPeerListings(peer: dict):
+    peerID = peer["peerID"]
+    basicListings = await obrequests.fetchBasicListings(peerID)
+    if type(basicListings) == list:
+        storedProfileData, storedListingIDs, indexedListingIDs = await db.getPeerListingState(peerID)
+        currentListingIDs = set(str(basicListing["hash"]) for basicListing in basicListings)
+        # a stored listing whose index write failed is fetched and indexed again like a new one
+        newBasicListings = [basicListing for basicListing in basicListings if str(basicListing["hash"]) not in indexedListingIDs]
+        peer["storedProfileData"] = storedProfileData
+        peer["keptListingIDs"] = list(indexedListingIDs & currentListingIDs)
+        peer["removedListingIDs"] = list(storedListingIDs - currentListingIDs)
+        peer["listings"] = await obrequests.fetchDetailedListings(peerID, newBasicListings)
+        return peer
+    return None
 
 
-async def insertPeerAndListings(peerID: str):
-    profileData = await obrequests.fetchProfile(peerID)
-    if type(profileData) == dict:
-        listings = await obrequests.fetchListings(peerID)
-        if type(listings) == list:
-            await elastic.indexListings(peerID, listings, profileData)
-            await db.insertListings(peerID, listings, True)
-            await db.insertPeer(peerID, profileData, True)
-            await asyncio.gather(*[updateBitcoinPrice(listing) for listing in listings])
+async def persistPeer(peer: dict):
+    listingCount = len(peer["keptListingIDs"]) + len(peer["listings"])
+    await db.insertPeerAndListings(peer["peerID"], peer["profileData"], peer["listings"], True, peer["removedListingIDs"], listingCount)
+    return peer
 
 
-async def insertPass():
-    peers = list(set(await db.getAllNewPeers())-set(await db.getAllPeers()))
-    peers = [peer[0] for peer in peers]
-    print(len(peers))
-    peers = getRandomSample(peers, 150)
-    print(len(peers))
-    await asyncio.gather(*[insertPeerAndListings(peerID) for peerID in peers])
+async def indexPeer(peer: dict):
+    peerID = peer["peerID"]
+    storedProfileData = peer["storedProfileData"]
+    try:
+        if storedProfileData is not None and elastic.buildPeerData(peerID, storedProfileData) != elastic.buildPeerData(peerID, peer["profileData"]):
+            await elastic.updatePeerData(peerID, peer["keptListingIDs"], peer["profileData"])
+        await elastic.indexListings(peerID, peer["listings"], peer["profileData"])
+        await elastic.deleteListings(peer["removedListingIDs"])
+    except Exception:
+        # the rows are already persisted, so without this the diff would count them as indexed
+        await db.markListingsUnindexed(peer["keptListingIDs"] + [str(listing["hash"]) for listing in peer["listings"]])
+        raise
+    return peer
 
 
-async def importFromCrawler():
+async def pricePeer(peer: dict):
+    await priceListings(peer["listings"])
+    return len(peer["keptListingIDs"]) + len(peer["listings"])
+
+
+def importStages():
+    return [
+        ("profile", fetchPeerProfile, pipeline.workerCount("profile", 16)),
+        ("listings", fetchPeerListings, pipeline.workerCount("listings", 16)),
+        ("persist", persistPeer, pipeline.workerCount("persist", 4)),
+        ("index", indexPeer, pipeline.workerCount("index", 4)),
+        ("price", pricePeer, pipeline.workerCount("price", 4))
+    ]
+
+
+async def markFailedListings():
+    failedListingIDs = elastic.takeFailedListingIDs()
+    if len(failedListingIDs) > 0:
+        await db.markListingsUnindexed(failedListingIDs)
+        log.warning("listings left for the next update after failed index writes:", len(failedListingIDs))
+
+
+async def importPeers(name: str, peers):
+    passStart = await elastic.startBulkPass()
     try:
-        await db.init()
-        await obrequests.init()
-        await elastic.init()
-        while True:
-            time.sleep(random.randint(10, 100))
-            await insertPass()
+        listingCounts, _ = await pipeline.runPipeline(name, ({"peerID": peerID} for peerID in peers), importStages())
     finally:
-        await elastic.close()
+        if await elastic.finishBulkPass(passStart) > 0:
+            await db.bumpIndexVersion()
+        await markFailedListings()
+        await peerhealth.flush()
+    return listingCounts
+
+
+async def insertPass():
+    peers = await db.getRandomUnimportedPeers(150)
+    log.info("peers to import:", len(peers))
+    return await importPeers("import", peers)
+
+
+async def importFromCrawler():
+    await worker.run(["import"])
 
 if __name__ == "__main__":
     asyncio.run(importFromCrawler())
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int, targetLatency: float, decrease: float = 0.7):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.targetLatency = targetLatency
+        self.decrease = decrease
+        self.inFlight = 0
+        self.lastDecrease = 0.0
+        self.successes = 0
+        self.errors = 0
+        self.slow = 0
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.inFlight < int(self.limit))
+            finally:
+                self.waiting -= 1
+            self.inFlight += 1
+        return time.monotonic()
+
+    async def release(self, start: float, ok: bool):
+        now = time.monotonic()
+        latency = now - start
+        async with self.condition:
+            self.inFlight -= 1
+            if ok and latency <= self.targetLatency:
+                self.successes += 1
+                self.limit = min(self.maximum, self.limit + 1/self.limit)
+            else:
+                if ok:
+                    self.successes += 1
+                    self.slow += 1
+                else:
+                    self.errors += 1
+                # back off at most once per target latency so one burst of failures is one signal
+                if now - self.lastDecrease > self.targetLatency:
+                    self.limit = max(self.minimum, self.limit*self.decrease)
+                    self.lastDecrease = now
+            self.condition.notify(max(0, int(self.limit) - self.inFlight))
+
+    def stats(self):
+        return {"limit": int(self.limit), "inFlight": self.inFlight, "successes": self.successes,
+                "errors": self.errors, "slow": self.slow, "waiting": self.waiting}
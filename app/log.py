@@ -0,0 +1,52 @@
+import logging
+import os
+import time
+
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("mobsearch")
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+lastEmitted = dict()
+
+
+def write(level: int, args: tuple):
+    # join lazily so disabled per-row messages cost one level check
+    if logger.isEnabledFor(level):
+        logger.log(level, " ".join(str(arg) for arg in args))
+
+
+def debug(*args):
+    write(logging.DEBUG, args)
+
+
+def info(*args):
+    write(logging.INFO, args)
+
+
+def warning(*args):
+    write(logging.WARNING, args)
+
+
+def error(*args):
+    write(logging.ERROR, args)
+
+
+def every(seconds: float, key, *args, level: int = logging.WARNING):
+    if not logger.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    last, suppressed = lastEmitted.get(key, (None, 0))
+    if last is not None and now - last < seconds:
+        lastEmitted[key] = (last, suppressed + 1)
+        return
+    lastEmitted[key] = (now, 0)
+    if suppressed > 0:
+        args = args + ("({} similar messages suppressed)".format(suppressed),)
+    write(level, args)
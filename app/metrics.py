@@ -0,0 +1,112 @@
+import contextlib
+import functools
+import time
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+counters = dict()
+gauges = dict()
+histograms = dict()
+collectors = []
+
+
+def labelKey(labels: dict):
+    return tuple(sorted((str(name), str(value)) for name, value in labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    key = (name, labelKey(labels))
+    counters[key] = counters.get(key, 0) + value
+
+
+def setGauge(name: str, value: float, **labels):
+    gauges[(name, labelKey(labels))] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = (name, labelKey(labels))
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [[0]*len(BUCKETS), 0.0, 0]
+    for index, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram[0][index] += 1
+            break
+    histogram[1] += seconds
+    histogram[2] += 1
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment(name.replace("_seconds", "_errors_total"), **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str):
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with timer(name, function=function.__name__):
+                return await function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def register(collector):
+    if collector not in collectors:
+        collectors.append(collector)
+
+
+def formatLabels(labels: tuple, extra: tuple = ()):
+    labels = labels + extra
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels) + "}"
+
+
+def render():
+    for collector in collectors:
+        collector()
+    lines = []
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted(set(name for name, _ in values)):
+            lines.append("# TYPE {} {}".format(name, kind))
+            for (metricName, labels), value in values.items():
+                if metricName == name:
+                    lines.append("{}{} {}".format(name, formatLabels(labels), value))
+    for name in sorted(set(name for name, _ in histograms)):
+        lines.append("# TYPE {} histogram".format(name))
+        for (metricName, labels), (buckets, total, count) in histograms.items():
+            if metricName != name:
+                continue
+            cumulative = 0
+            for bound, bucketCount in zip(BUCKETS, buckets):
+                cumulative += bucketCount
+                lines.append("{}_bucket{} {}".format(name, formatLabels(labels, (("le", str(bound)),)), cumulative))
+            lines.append("{}_bucket{} {}".format(name, formatLabels(labels, (("le", "+Inf"),)), count))
+            lines.append("{}_sum{} {}".format(name, formatLabels(labels), total))
+            lines.append("{}_count{} {}".format(name, formatLabels(labels), count))
+    return "\n".join(lines) + "\n"
+
+
+async def startServer(host: str, port: int):
+    from aiohttp import web
+
+    async def handleMetrics(request):
+        return web.Response(text=render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handleMetrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
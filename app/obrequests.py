@@ -1,56 +1,160 @@
 import asyncio
 import aiohttp
+import collections
 import os
 import time
 import random
+import log
+import metrics
+import peerhealth
+from limiter import AdaptiveLimiter
+
+
+Result = collections.namedtuple("Result", ["status", "data", "attempts", "latency"])
+
+RETRYABLE = {"timeout", "error", "overloaded"}
+
+PEER_STATUS_TTL = float(os.environ.get("PEER_STATUS_TTL", 300))
+PEER_STATUS_CACHE_SIZE = int(os.environ.get("PEER_STATUS_CACHE_SIZE", 10000))
+peerStatuses = collections.OrderedDict()
+
+BUDGETS = {
+    "listing": ("/ob/listing/", "/ob/listings/"),
+    "profile": ("/ob/profile/",),
+    "peers": ("/ob/closestpeers/", "/ob/followers", "/ob/following", "/ob/peers", "/ob/status/")
+}
 
 
 async def init():
     
-    global OPENBAZAAR_HOST, OPENBAZAAR_USER, OPENBAZAAR_PASS, requestSemaphore
+    global OPENBAZAAR_HOST, OPENBAZAAR_PORT, OPENBAZAAR_USER, OPENBAZAAR_PASS, REQUEST_TIMEOUT, REQUEST_RETRIES, BACKOFF_BASE, BACKOFF_MAX, limiters
     OPENBAZAAR_HOST = os.environ["OPENBAZAAR_HOST"]
+    OPENBAZAAR_PORT = os.environ.get("OPENBAZAAR_PORT", "4002")
     OPENBAZAAR_USER = os.environ["OPENBAZAAR_USER"]
     OPENBAZAAR_PASS = os.environ["OPENBAZAAR_PASS"]
-    requestSemaphore = asyncio.Semaphore(64)
+    REQUEST_TIMEOUT = float(os.environ.get("OPENBAZAAR_TIMEOUT", 10))
+    REQUEST_RETRIES = int(os.environ.get("OPENBAZAAR_RETRIES", 2))
+    BACKOFF_BASE = float(os.environ.get("OPENBAZAAR_BACKOFF_BASE", 0.5))
+    BACKOFF_MAX = float(os.environ.get("OPENBAZAAR_BACKOFF_MAX", 8))
+    limiters = {budget: createLimiter(budget) for budget in list(BUDGETS) + ["default"]}
+    metrics.register(collectLimiterStats)
+    # requests queued inside aiohttp would count as latency against the budgets and time out against peers
+    createSession(sum(limiter.maximum for limiter in limiters.values()))
 
     for _ in range(30):
-        try:
-            await asyncRequest("/ob/peers")
+        result = await asyncRequest("/ob/peers", retries=0)
+        if result.status in ("ok", "failure"):
             break
-        except aiohttp.client_exceptions.ClientConnectorError:
-            print("cannot connect to OB via {}, trying again...".format(OPENBAZAAR_HOST))
-            time.sleep(random.randint(10,50)/10)
-    time.sleep(random.randint(10,50)/10)
+        log.warning("cannot connect to OB via {} ({}), trying again...".format(OPENBAZAAR_HOST, result.status))
+        await asyncio.sleep(random.randint(10,50)/10)
+    await asyncio.sleep(random.randint(10,50)/10)
 
 
-async def asyncRequest(endpoint: str):
-    async with requestSemaphore:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("http://{}:{}@{}:4002{}".format(OPENBAZAAR_USER, OPENBAZAAR_PASS, OPENBAZAAR_HOST, endpoint), timeout=10) as response:
-                    data = await response.json()
-            if type(data) == dict and data.get("success") == False:
-                return "failure"
-            return data     
-        except asyncio.TimeoutError:
-            return "timeout"
-        
-
-
-async def getBitcoinPrice(currencyCode: str, amount: float):
-    if currencyCode == "BTC":
-        return amount
-    async with requestSemaphore:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://blockchain.info/tobtc?currency={}&value={}".format(currencyCode, amount), timeout=5) as response:
-                    data = await response.text()
+def createLimiter(budget: str):
+    prefix = "OPENBAZAAR_{}_".format(budget.upper())
+    return AdaptiveLimiter(budget,
+        initial=int(os.environ.get(prefix + "CONCURRENCY", 16)),
+        minimum=int(os.environ.get(prefix + "MIN_CONCURRENCY", 2)),
+        maximum=int(os.environ.get(prefix + "MAX_CONCURRENCY", 64)),
+        targetLatency=float(os.environ.get(prefix + "TARGET_LATENCY", 2)))
+
+
+def createSession(budgetConnections: int = 64):
+    global session
+    connectionsPerHost = int(os.environ.get("OPENBAZAAR_CONNECTION_LIMIT_PER_HOST", budgetConnections))
+    if connectionsPerHost < budgetConnections:
+        log.warning("OPENBAZAAR_CONNECTION_LIMIT_PER_HOST {} is below the {} requests the budgets allow, the rest queue in aiohttp".format(connectionsPerHost, budgetConnections))
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get("OPENBAZAAR_CONNECTION_LIMIT", max(100, connectionsPerHost))),
+        limit_per_host=connectionsPerHost,
+        keepalive_timeout=float(os.environ.get("OPENBAZAAR_KEEPALIVE_TIMEOUT", 30)),
+        use_dns_cache=True,
+        ttl_dns_cache=int(os.environ.get("OPENBAZAAR_DNS_CACHE_TTL", 300)))
+    session = aiohttp.ClientSession(connector=connector)
+
+
+async def close():
+    await session.close()
+
+
+def endpointBudget(endpoint: str):
+    for budget, prefixes in BUDGETS.items():
+        if endpoint.startswith(prefixes):
+            return budget
+    return "default"
+
+
+def backoffDelay(attempt: int):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE*2**attempt))
+
+
+async def sendRequest(endpoint: str):
+    try:
+        async with session.get("http://{}:{}@{}:{}{}".format(OPENBAZAAR_USER, OPENBAZAAR_PASS, OPENBAZAAR_HOST, OPENBAZAAR_PORT, endpoint), timeout=REQUEST_TIMEOUT) as response:
             try:
-                return float(data)
+                data = await response.json(content_type=None)
             except ValueError:
-                return "no float"
-        except asyncio.TimeoutError:
-            return "timeout"
+                data = None
+            status = response.status
+    except asyncio.TimeoutError:
+        return "timeout", None
+    except (aiohttp.ClientError, ConnectionError):
+        return "error", None
+    if type(data) == dict and data.get("success") == False:
+        return "failure", data
+    if status in (429, 503):
+        return "overloaded", data
+    if status >= 500:
+        return "error", data
+    if data is None:
+        return "invalid", None
+    return "ok", data
+
+
+async def asyncRequest(endpoint: str, retries: int = None):
+    budget = endpointBudget(endpoint)
+    limiter = limiters[budget]
+    retries = REQUEST_RETRIES if retries is None else retries
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        waitStart = time.monotonic()
+        requestStart = await limiter.acquire()
+        metrics.observe("openbazaar_limiter_wait_seconds", requestStart - waitStart, budget=budget)
+        status = "error"
+        try:
+            status, data = await sendRequest(endpoint)
+        finally:
+            # a node that answers "failure" quickly is healthy, so only congestion counts against the budget
+            await limiter.release(requestStart, status not in RETRYABLE)
+            metrics.observe("openbazaar_request_seconds", time.monotonic() - requestStart, budget=budget)
+            metrics.increment("openbazaar_requests_total", budget=budget, status=status)
+        attempt += 1
+        if status not in RETRYABLE or attempt > retries:
+            return Result(status, data, attempt, time.monotonic() - start)
+        metrics.increment("openbazaar_retries_total", budget=budget)
+        await asyncio.sleep(backoffDelay(attempt))
+
+
+def stats():
+    return {budget: limiter.stats() for budget, limiter in limiters.items()}
+
+
+def collectLimiterStats():
+    for budget, budgetStats in stats().items():
+        for name in ("limit", "inFlight", "waiting"):
+            metrics.setGauge("openbazaar_limiter_" + name, budgetStats[name], budget=budget)
+
+
+async def getBitcoinTicker():
+    try:
+        async with session.get("https://blockchain.info/ticker", timeout=5) as response:
+            data = await response.json(content_type=None)
+        if type(data) == dict:
+            return {str(code): float(rate["last"]) for code, rate in data.items() if type(rate) == dict and "last" in rate}
+        return None
+    except (asyncio.TimeoutError, aiohttp.ClientError, ValueError):
+        return None
 
 
 def buildListingData(basicListing: dict, detailedListing: dict):
@@ -82,40 +186,63 @@ def buildListingData(basicListing: dict, detailedListing: dict):
     return listingData
 
 
-async def fetchListings(peerID: str):
+async def fetchBasicListings(peerID: str):
+    endpoint = "/ob/listings/{}".format(peerID)
+    result = await asyncRequest(endpoint)
+    peerhealth.observe(peerID, result.status)
+    basicListings = result.data
+    # an empty list is a vendor with no listings left, only a failed or malformed response is None
+    if result.status == "ok" and type(basicListings) == list:
+        if len(basicListings) == 0 or type(basicListings[0]) == dict:
+            return basicListings
+    return None
+
+
+async def fetchDetailedListings(peerID: str, basicListings: list):
 
     async def fetchListing(basicListing: dict, peerID: str):
         endpoint = "/ob/listing/{}/{}".format(peerID, basicListing["hash"])
-        detailedListing = await asyncRequest(endpoint)
-        if type(detailedListing) == dict:
+        result = await asyncRequest(endpoint)
+        detailedListing = result.data
+        if result.status == "ok" and type(detailedListing) == dict:
             listingData = buildListingData(basicListing, detailedListing["listing"])
             return listingData
         return None
 
-    endpoint = "/ob/listings/{}".format(peerID)
-    basicListings = await asyncRequest(endpoint)
+    listings = await asyncio.gather(*[fetchListing(basicListing, peerID) for basicListing in basicListings])
+    return [listing for listing in listings if listing != None]
+
+
+async def fetchListings(peerID: str):
+    basicListings = await fetchBasicListings(peerID)
     if type(basicListings) == list:
-        if len(basicListings) > 0:
-            if type(basicListings[0]) == dict:
-                listings = await asyncio.gather(*[fetchListing(basicListing, peerID) for basicListing in basicListings])
-                return [listing for listing in listings if listing != None]
+        return await fetchDetailedListings(peerID, basicListings)
     return None
 
 
 async def fetchProfile(peerID: str):
     endpoint = "/ob/profile/{}".format(peerID)
-    profile = await asyncRequest(endpoint)
-    if type(profile) == dict:
+    result = await asyncRequest(endpoint)
+    peerhealth.observe(peerID, result.status)
+    profile = result.data
+    if result.status == "ok" and type(profile) == dict:
         return profile
     return None
 
 
-async def fetchAPeerList(endpoint: str):
-    peers = await asyncRequest(endpoint)
-    if type(peers) == list and len(peers) > 0 and type(peers[0]) == str:
+async def fetchPeerList(endpoint: str, peerID: str = None):
+    result = await asyncRequest(endpoint)
+    if peerID is not None:
+        peerhealth.observe(peerID, result.status)
+    peers = result.data
+    if result.status == "ok" and type(peers) == list and (len(peers) == 0 or type(peers[0]) == str):
         return peers
-    else:
-        return []
+    return None
+
+
+async def fetchAPeerList(endpoint: str, peerID: str = None):
+    peers = await fetchPeerList(endpoint, peerID)
+    return peers if peers is not None else []
 
 
 async def fetchConnectedPeers():
@@ -133,35 +260,50 @@ async def fetchFollowPeers():
 
     
 async def fetchNewPeers(peerID: str):
-    endpoints = ["/ob/closestpeers/{}".format(peerID),
-                 "/ob/following/{}".format(peerID),
-                 "/ob/followers/{}".format(peerID)]
-    newPeers = await asyncio.gather(*[fetchAPeerList(endpoint) for endpoint in endpoints])
-    newPeers = [y for x in newPeers for y in x]
+    # closestpeers is answered from the DHT, so only the follow lists say whether the peer itself is reachable
+    newPeers = await asyncio.gather(fetchPeerList("/ob/closestpeers/{}".format(peerID)),
+                                    fetchPeerList("/ob/following/{}".format(peerID), peerID),
+                                    fetchPeerList("/ob/followers/{}".format(peerID), peerID))
+    # None when nothing answered, so the seed is crawled again once its lease runs out
+    if all(peers is None for peers in newPeers):
+        return None
+    newPeers = [y for x in newPeers if x is not None for y in x]
     newPeers = list(set(newPeers))
     return newPeers
 
 
 async def peerOnline(peerID: str):
+    cached = peerStatuses.get(peerID)
+    if cached is not None and cached[0] > time.monotonic():
+        return [peerID, cached[1]]
     endpoint = "/ob/status/{}".format(peerID)
-    status = await asyncRequest(endpoint)
-    if type(status) == dict:
-        if status.get("status") == "online":
-            return [peerID, True]
-    return [peerID, False]
+    result = await asyncRequest(endpoint)
+    status = result.data
+    online = result.status == "ok" and type(status) == dict and status.get("status") == "online"
+    if result.status == "ok" or result.status in peerhealth.UNREACHABLE:
+        peerhealth.observe(peerID, "ok" if online else "timeout")
+        peerStatuses[peerID] = (time.monotonic() + PEER_STATUS_TTL, online)
+        peerStatuses.move_to_end(peerID)
+        while len(peerStatuses) > PEER_STATUS_CACHE_SIZE:
+            peerStatuses.popitem(last=False)
+    return [peerID, online]
 
 
 async def getConfig():
     endpoint = "/ob/config"
-    config = await asyncRequest(endpoint)
-    if type(config) == dict:
+    result = await asyncRequest(endpoint)
+    config = result.data
+    if result.status == "ok" and type(config) == dict:
         return config
     else:
         return None
 
 
 async def main():
-    await init()
+    try:
+        await init()
+    finally:
+        await close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,36 @@
+import os
+import db
+import log
+import metrics
+
+
+COOL_DOWN_BASE = float(os.environ.get("PEER_COOL_DOWN_BASE", 600))
+COOL_DOWN_MAX = float(os.environ.get("PEER_COOL_DOWN_MAX", 7*24*3600))
+
+# statuses that say something about the remote peer rather than about our own node
+UNREACHABLE = {"timeout", "failure"}
+
+pending = dict()
+
+
+def observe(peerID: str, status: str):
+    if status == "ok":
+        pending[peerID] = True
+    elif status in UNREACHABLE:
+        pending[peerID] = pending.get(peerID, False)
+
+
+async def flush():
+    global pending
+    observed, pending = pending, dict()
+    reachable = [peerID for peerID, online in observed.items() if online]
+    unreachable = [peerID for peerID, online in observed.items() if not online]
+    if len(reachable) > 0:
+        await db.recordPeerSuccesses(reachable)
+    if len(unreachable) > 0:
+        await db.recordPeerFailures(unreachable, COOL_DOWN_BASE, COOL_DOWN_MAX)
+    metrics.increment("peers_reachable_total", len(reachable))
+    metrics.increment("peers_unreachable_total", len(unreachable))
+    if len(observed) > 0:
+        log.info("peer health: {} reachable, {} cooling down".format(len(reachable), len(unreachable)))
+    return len(reachable), len(unreachable)
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+import log
+import metrics
+
+
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 32))
+REPORT_INTERVAL = float(os.environ.get("PIPELINE_REPORT_INTERVAL", 30))
+
+
+def workerCount(name: str, default: int):
+    return int(os.environ.get("PIPELINE_{}_WORKERS".format(name.upper()), default))
+
+
+def newStageStats(name: str, workers: int):
+    return {"name": name, "workers": workers, "processed": 0, "dropped": 0, "errors": 0,
+            "latency": 0.0, "maxLatency": 0.0, "maxDepth": 0}
+
+
+def formatStageStats(stats: dict, queue: asyncio.Queue = None):
+    meanLatency = stats["latency"]/stats["processed"] if stats["processed"] > 0 else 0
+    return "{:<10} workers {:>3} processed {:>6} dropped {:>5} errors {:>4} mean {:>8.1f}ms max {:>8.1f}ms depth {:>3}/{:<3}".format(
+        stats["name"], stats["workers"], stats["processed"], stats["dropped"], stats["errors"],
+        meanLatency*1000, stats["maxLatency"]*1000, queue.qsize() if queue is not None else 0, stats["maxDepth"])
+
+
+async def runPipeline(name: str, items, stages: list, queueSize: int = None):
+    queues = [asyncio.Queue(maxsize=queueSize or QUEUE_SIZE) for _ in stages]
+    stats = [newStageStats(stageName, workers) for stageName, _, workers in stages]
+    outputs = []
+
+    async def put(index: int, item):
+        await queues[index].put(item)
+        stats[index]["maxDepth"] = max(stats[index]["maxDepth"], queues[index].qsize())
+        metrics.setGauge("pipeline_queue_depth", queues[index].qsize(), pipeline=name, stage=stats[index]["name"])
+
+    async def work(index: int):
+        _, handler, _ = stages[index]
+        while True:
+            item = await queues[index].get()
+            try:
+                start = time.monotonic()
+                try:
+                    result = await handler(item)
+                except Exception as exception:
+                    stats[index]["errors"] += 1
+                    metrics.increment("pipeline_errors_total", pipeline=name, stage=stats[index]["name"])
+                    log.every(10, (name, stats[index]["name"]), "pipeline", name, stats[index]["name"], "failed:", repr(exception))
+                    continue
+                finally:
+                    elapsed = time.monotonic() - start
+                    stats[index]["processed"] += 1
+                    stats[index]["latency"] += elapsed
+                    stats[index]["maxLatency"] = max(stats[index]["maxLatency"], elapsed)
+                    metrics.observe("pipeline_stage_seconds", elapsed, pipeline=name, stage=stats[index]["name"])
+                if result is None:
+                    stats[index]["dropped"] += 1
+                elif index + 1 < len(stages):
+                    await put(index + 1, result)
+                else:
+                    outputs.append(result)
+            finally:
+                queues[index].task_done()
+
+    async def report():
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            for stageStats, queue in zip(stats, queues):
+                log.info("pipeline", name, formatStageStats(stageStats, queue))
+
+    workers = [[asyncio.ensure_future(work(index)) for _ in range(stageWorkers)] for index, (_, _, stageWorkers) in enumerate(stages)]
+    reporter = asyncio.ensure_future(report()) if REPORT_INTERVAL > 0 else None
+    start = time.monotonic()
+    try:
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await put(0, item)
+        else:
+            for item in items:
+                await put(0, item)
+        for queue in queues:
+            await queue.join()
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        for stageWorkers in workers:
+            for worker in stageWorkers:
+                worker.cancel()
+        await asyncio.gather(*[worker for stageWorkers in workers for worker in stageWorkers], return_exceptions=True)
+
+    log.info("pipeline", name, "finished in {:.1f}s".format(time.monotonic() - start))
+    for stageStats in stats:
+        log.info("pipeline", name, formatStageStats(stageStats))
+    return outputs, stats
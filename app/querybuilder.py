@@ -0,0 +1,88 @@
+from functools import lru_cache
+
+
+TEXT_FIELDS = ["listingData.title^5", "tags^2", "description", "peerData.name"]
+SOURCE_FIELDS = ["listingData", "peerData", "moderators", "equivalentBitcoinPrice"]
+SORTS = {
+    "relevance": [{"_score": {"order": "desc"}}, {"listingID": {"order": "asc"}}],
+    "price-asc": [{"equivalentBitcoinPrice": {"order": "asc"}}, {"listingID": {"order": "asc"}}],
+    "price-desc": [{"equivalentBitcoinPrice": {"order": "desc"}}, {"listingID": {"order": "asc"}}]
+}
+FACET_FIELDS = {
+    "shipsTo": ("shipsTo", 300),
+    "acceptedCurrencies": ("acceptedCurrencies", 50),
+    "nsfw": ("listingData.nsfw", 2),
+    "contractTypes": ("contractType", 20)
+}
+
+
+def normaliseTerms(values: list):
+    return tuple(sorted(set(str(value).upper() for value in values)))
+
+
+@lru_cache(maxsize=1024)
+def buildFilters(shipsTo: str, acceptedCurrencies: tuple, nsfw: bool, contractTypes: tuple):
+    filters = []
+    if shipsTo != "any":
+        filters.append(("shipsTo", {"terms": {"shipsTo": [shipsTo.upper(), "ANY"]}}))
+    if len(acceptedCurrencies) > 0:
+        filters.append(("acceptedCurrencies", {"terms": {"acceptedCurrencies": list(acceptedCurrencies)}}))
+    if not nsfw:
+        filters.append(("nsfw", {"term": {"listingData.nsfw": False}}))
+    if len(contractTypes) > 0:
+        filters.append(("contractTypes", {"terms": {"contractType": list(contractTypes)}}))
+    return tuple(filters)
+
+
+@lru_cache(maxsize=1024)
+def buildAggregations(shipsTo: str, acceptedCurrencies: tuple, nsfw: bool, contractTypes: tuple):
+    filters = buildFilters(shipsTo, acceptedCurrencies, nsfw, contractTypes)
+    aggregations = dict()
+    for name, (field, size) in FACET_FIELDS.items():
+        otherFilters = [facetFilter for facetName, facetFilter in filters if facetName != name]
+        aggregations[name] = {
+            "filter": {"bool": {"filter": otherFilters}},
+            "aggs": {"values": {"terms": {"field": field, "size": size}}}
+        }
+    return aggregations
+
+
+def buildQuery(query: str, filters: tuple):
+    query = query.strip()
+    if query == "" or query == "*":
+        match = {"match_all": {}}
+    else:
+        match = {"multi_match": {"query": query, "fields": TEXT_FIELDS}}
+    return {"bool": {"must": match, "filter": [facetFilter for _, facetFilter in filters]}}
+
+
+def buildBody(query: str,
+              size: int,
+              start: int,
+              sortBy: str,
+              shipsTo: str,
+              acceptedCurrencies: list,
+              nsfw: bool,
+              contractTypes: list,
+              searchAfter: list = None,
+              facets: bool = False):
+
+    acceptedCurrencies = normaliseTerms(acceptedCurrencies)
+    contractTypes = normaliseTerms(contractTypes)
+    filters = buildFilters(shipsTo, acceptedCurrencies, nsfw, contractTypes)
+    body = {
+        "size": size,
+        "_source": SOURCE_FIELDS,
+        "sort": SORTS.get(sortBy, SORTS["relevance"])
+    }
+    if facets:
+        body["query"] = buildQuery(query, ())
+        body["post_filter"] = {"bool": {"filter": [facetFilter for _, facetFilter in filters]}}
+        body["aggs"] = buildAggregations(shipsTo, acceptedCurrencies, nsfw, contractTypes)
+    else:
+        body["query"] = buildQuery(query, filters)
+    if searchAfter is None:
+        body["from"] = start
+    else:
+        body["search_after"] = searchAfter
+    return body
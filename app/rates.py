@@ -0,0 +1,76 @@
+import asyncio
+import json
+import log
+import os
+import time
+import obrequests
+
+
+RATES_TTL = float(os.environ.get("EXCHANGE_RATES_TTL", 600))
+RATES_RETRY = float(os.environ.get("EXCHANGE_RATES_RETRY", 30))
+RATES_FILE = os.environ.get("EXCHANGE_RATES_FILE", "")
+
+with open("currencyExponents.json") as file:
+    currencyExponents = json.load(file)
+
+rates = dict()
+ratesExpire = 0
+ratesLock = None
+
+
+def loadRatesFile(path: str):
+    with open(path) as file:
+        data = json.load(file)
+    return {str(code).upper(): float(rate["last"] if type(rate) == dict else rate) for code, rate in data.items()}
+
+
+async def getRates():
+    global rates, ratesExpire, ratesLock
+    if time.monotonic() < ratesExpire:
+        return rates
+    if ratesLock is None:
+        ratesLock = asyncio.Lock()
+    async with ratesLock:
+        if time.monotonic() < ratesExpire:
+            return rates
+        if RATES_FILE != "":
+            newRates = loadRatesFile(RATES_FILE)
+        else:
+            newRates = await obrequests.getBitcoinTicker()
+        if type(newRates) == dict and len(newRates) > 0:
+            rates = newRates
+            ratesExpire = time.monotonic() + RATES_TTL
+            log.info("exchange rates updated:", len(rates))
+        else:
+            ratesExpire = time.monotonic() + RATES_RETRY
+            log.warning("unable to update exchange rates, keeping", len(rates))
+    return rates
+
+
+def toMajorUnits(currencyCode: str, amount: float):
+    if currencyCode not in currencyExponents:
+        return None
+    return float(amount)*(10**(-1*int(currencyExponents[currencyCode])))
+
+
+def satoshisPerUnit(currencyCode: str, rates: dict):
+    unit = toMajorUnits(currencyCode, 1)
+    if unit is None:
+        return None
+    if currencyCode == "BTC":
+        return unit*(10**8)
+    rate = rates.get(currencyCode)
+    if not rate:
+        return None
+    return unit/rate*(10**8)
+
+
+def toSatoshis(currencyCode: str, amount: float, rates: dict):
+    factor = satoshisPerUnit(currencyCode, rates)
+    if factor is None:
+        return None
+    return int(round(float(amount)*factor))
+
+
+async def convertToSatoshis(currencyCode: str, amount: float):
+    return toSatoshis(currencyCode, amount, await getRates())
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+import db
+import elastic
+import log
+import obrequests
+
+
+# rows stamped just before a replay starts may commit after it has read them
+REPLAY_MARGIN = timedelta(seconds=float(os.environ.get("ELASTICSEARCH_REINDEX_MARGIN", 60)))
+
+
+def buildDocument(peerID: str, basicListing: str, detailedListing: str, equivalentBitcoinPrice: int, profileData: str):
+    listing = obrequests.buildListingData(json.loads(basicListing), json.loads(detailedListing))
+    document = elastic.buildDocument(peerID, listing, json.loads(profileData))
+    document["equivalentBitcoinPrice"] = int(equivalentBitcoinPrice or 0)
+    return document
+
+
+async def stream(newIndex: str):
+    listingCount = 0
+    async for listingID, peerID, basicListing, detailedListing, equivalentBitcoinPrice, profileData in db.iterateIndexableListings():
+        document = buildDocument(peerID, basicListing, detailedListing, equivalentBitcoinPrice, profileData)
+        await elastic.queueBulkAction({"create": {"_index": newIndex, "_id": listingID}}, document)
+        listingCount += 1
+    await elastic.drainBulk()
+    return listingCount
+
+
+async def replay(newIndex: str, since: datetime):
+    # peers that changed lose their documents and get them back from Postgres, which drops deleted listings,
+    # creates never overwrite a newer live write, and listings that only changed price get the current price
+    await elastic.es.indices.refresh(index=newIndex)
+    changedPeers = await db.getPeersChangedSince(since)
+    await elastic.deletePeerListings(newIndex, changedPeers)
+    listingCount = 0
+    async for listingID, peerID, basicListing, detailedListing, equivalentBitcoinPrice, profileData, peerChanged in db.iterateListingsChangedSince(since):
+        if peerChanged:
+            document = buildDocument(peerID, basicListing, detailedListing, equivalentBitcoinPrice, profileData)
+            await elastic.queueBulkAction({"create": {"_index": newIndex, "_id": listingID}}, document)
+        else:
+            body = {"doc": {"equivalentBitcoinPrice": int(equivalentBitcoinPrice or 0)}}
+            await elastic.queueBulkAction({"update": {"_index": newIndex, "_id": listingID}}, body)
+        listingCount += 1
+    await elastic.drainBulk()
+    log.info("replayed changes since", since, "into", newIndex, len(changedPeers), "peers", listingCount, "listings")
+
+
+async def rebuild():
+    oldIndices = await elastic.getAliasIndices(elastic.READ_ALIAS)
+    newIndex = await elastic.createVersionedIndex()
+
+    # live writes keep going to the old index, which also keeps serving reads, while the snapshot streams in
+    writeSwitched = False
+    try:
+        snapshotStart = datetime.now() - REPLAY_MARGIN
+        listingCount = await stream(newIndex)
+        log.info("listings streamed into", newIndex, listingCount)
+
+        catchUpStart = datetime.now() - REPLAY_MARGIN
+        await replay(newIndex, snapshotStart)
+        await elastic.pointAlias(elastic.WRITE_ALIAS, newIndex)
+        writeSwitched = True
+        # only what changed during the catch up is left, live writes now land in the new index too
+        await replay(newIndex, catchUpStart)
+
+        await elastic.es.indices.put_settings(index=newIndex, body={"index": {"refresh_interval": elastic.INDEX_REFRESH_INTERVAL}})
+        await elastic.es.indices.refresh(index=newIndex)
+    except BaseException:
+        log.error("rebuild failed, deleting", newIndex)
+        if writeSwitched:
+            await elastic.pointAlias(elastic.WRITE_ALIAS, oldIndices[0] if len(oldIndices) > 0 else elastic.READ_ALIAS)
+        await elastic.deleteIndices([newIndex])
+        raise
+
+    await elastic.pointAlias(elastic.READ_ALIAS, newIndex)
+    await db.bumpIndexVersion()
+    failedListingIDs = elastic.takeFailedListingIDs()
+    if len(failedListingIDs) > 0:
+        await db.markListingsUnindexed(failedListingIDs)
+        log.warning("listings missing from", newIndex, "until their peers are next updated:", len(failedListingIDs))
+    if not elastic.KEEP_OLD_INDICES:
+        await elastic.deleteIndices([oldIndex for oldIndex in oldIndices if oldIndex != newIndex])
+
+
+async def main():
+    try:
+        await db.init()
+        await elastic.init()
+        await rebuild()
+    finally:
+        await elastic.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
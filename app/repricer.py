@@ -0,0 +1,60 @@
+import asyncio
+import db
+import elastic
+import log
+import obrequests
+import rates
+
+
+async def repricePass():
+    currentRates = await rates.getRates()
+    factors = dict()
+    skipped = dict()
+
+    prices = []
+    async for listingID, pricingCurrency, price, oldPrice in db.iterateListingPrices():
+        if pricingCurrency is None or pricingCurrency == "" or price is None:
+            continue
+        if pricingCurrency not in factors:
+            factors[pricingCurrency] = rates.satoshisPerUnit(pricingCurrency, currentRates)
+        factor = factors[pricingCurrency]
+        if factor is None:
+            skipped[pricingCurrency] = skipped.get(pricingCurrency, 0) + 1
+            continue
+        newPrice = int(round(float(price)*factor))
+        if newPrice != oldPrice:
+            prices.append((listingID, newPrice))
+
+    for pricingCurrency, count in skipped.items():
+        log.warning("no exchange rate for", pricingCurrency, "skipped", count, "listings")
+    log.info("listings repriced:", len(prices), "currencies:", len(factors))
+    if len(prices) == 0:
+        return 0
+
+    passStart = await elastic.startBulkPass()
+    try:
+        for listingID, equivalentBitcoinPrice in prices:
+            await elastic.updateBitcoinPrice(listingID, equivalentBitcoinPrice)
+        await db.updateBitcoinPrices(prices)
+    finally:
+        if await elastic.finishBulkPass(passStart) > 0:
+            await db.bumpIndexVersion()
+        failedListingIDs = elastic.takeFailedListingIDs()
+        if len(failedListingIDs) > 0:
+            await db.markListingsUnindexed(failedListingIDs)
+    return len(prices)
+
+
+async def main():
+    # only the exchange rate ticker needs the HTTP session, init() would also poll the OpenBazaar node
+    obrequests.createSession()
+    try:
+        await db.init()
+        await elastic.init()
+        await repricePass()
+    finally:
+        await obrequests.close()
+        await elastic.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
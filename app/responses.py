@@ -0,0 +1,46 @@
+import orjson
+
+
+def dumps(value):
+    return orjson.dumps(value)
+
+
+def compileOptions(name: str, optionGroup: dict):
+    header = {key: value for key, value in optionGroup.items() if key != "options"}
+    prefix = dumps(name) + b":" + dumps({**header, "options": []})[:-2]
+    options = [(option["value"], dumps({**option, "checked": False}), dumps({**option, "checked": True}))
+               for option in optionGroup["options"]]
+    return name, prefix, options
+
+
+def compileTemplate(template: dict):
+    static = {key: value for key, value in template.items() if key not in ("links", "options", "sortBy", "results")}
+    skeleton = dict()
+    skeleton["head"] = dumps({**static, "links": None})[:-5]
+    skeleton["links"] = dict(template["links"])
+    skeleton["options"] = [compileOptions(name, optionGroup) for name, optionGroup in template["options"].items()]
+    skeleton["sortBy"] = [(key, dumps(key) + b":" + dumps({**value, "selected": False}), dumps(key) + b":" + dumps({**value, "selected": True}))
+                          for key, value in template["sortBy"].items()]
+    return skeleton
+
+
+def renderResponse(skeleton: dict, links: dict, checked: dict, sortBy: str, resultsJSON: bytes, facetsJSON: bytes = None):
+    parts = [skeleton["head"], dumps({**skeleton["links"], **links}), b',"options":{']
+    for index, (name, prefix, options) in enumerate(skeleton["options"]):
+        selected = checked.get(name, ())
+        if index > 0:
+            parts.append(b",")
+        parts.append(prefix)
+        parts.append(b",".join(checkedOption if value in selected else uncheckedOption
+                               for value, uncheckedOption, checkedOption in options))
+        parts.append(b"]}")
+    parts.append(b'},"sortBy":{')
+    parts.append(b",".join(selectedSort if key == sortBy else unselectedSort
+                           for key, unselectedSort, selectedSort in skeleton["sortBy"]))
+    parts.append(b'},"results":')
+    parts.append(resultsJSON)
+    if facetsJSON is not None:
+        parts.append(b',"facets":')
+        parts.append(facetsJSON)
+    parts.append(b"}")
+    return b"".join(parts)
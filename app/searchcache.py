@@ -0,0 +1,127 @@
+import asyncio
+import log
+import os
+import time
+from collections import OrderedDict
+
+
+CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 60))
+VERSION_INTERVAL = float(os.environ.get("SEARCH_CACHE_VERSION_INTERVAL", 5))
+
+entries = OrderedDict()
+cursors = OrderedDict()
+inFlight = dict()
+counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+version = None
+versionExpire = 0
+
+
+def makeKey(query: str,
+            pageSize: int,
+            pageNumber: int,
+            sortBy: str,
+            shipsTo: str,
+            acceptedCurrencies: list,
+            nsfw: bool,
+            contractTypes: list):
+    return (version,
+            query.strip(),
+            pageSize,
+            pageNumber,
+            sortBy,
+            shipsTo,
+            tuple(sorted(set(acceptedCurrency.upper() for acceptedCurrency in acceptedCurrencies))),
+            nsfw,
+            tuple(sorted(set(contractType.upper() for contractType in contractTypes))))
+
+
+async def refreshVersion(getVersion):
+    global version, versionExpire
+    if time.monotonic() < versionExpire:
+        return version
+    versionExpire = time.monotonic() + VERSION_INTERVAL
+    try:
+        newVersion = await getVersion()
+    except Exception as exception:
+        log.every(10, "index version", "unable to check index version:", exception)
+        return version
+    if newVersion != version:
+        version = newVersion
+        entries.clear()
+        cursors.clear()
+    return version
+
+
+def peek(key: tuple):
+    entry = entries.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        entries.move_to_end(key)
+        return entry[1]
+    return None
+
+
+def store(key: tuple, value):
+    entries[key] = (time.monotonic() + CACHE_TTL, value)
+    entries.move_to_end(key)
+    while len(entries) > CACHE_SIZE:
+        entries.popitem(last=False)
+        counters["evictions"] += 1
+
+
+async def getOrCompute(key: tuple, compute):
+    value = peek(key)
+    if value is not None:
+        counters["hits"] += 1
+        return value
+
+    if key in inFlight:
+        counters["coalesced"] += 1
+    while key in inFlight:
+        future = inFlight[key]
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the leader's client went away, so the first waiter to wake up takes over the computation
+            if not future.cancelled():
+                raise
+
+    counters["misses"] += 1
+    future = asyncio.get_event_loop().create_future()
+    inFlight[key] = future
+    try:
+        value = await compute()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as exception:
+        future.set_exception(exception)
+        future.exception()
+        raise
+    finally:
+        del inFlight[key]
+
+    future.set_result(value)
+    store(key, value)
+    return value
+
+
+def rememberCursor(key: tuple, searchAfter: list):
+    cursors[key] = searchAfter
+    cursors.move_to_end(key)
+    while len(cursors) > CACHE_SIZE:
+        cursors.popitem(last=False)
+
+
+def getCursor(key: tuple):
+    return cursors.get(key)
+
+
+def stats():
+    lookups = counters["hits"] + counters["misses"] + counters["coalesced"]
+    return {
+        **counters,
+        "size": len(entries),
+        "version": version,
+        "hitRate": (counters["hits"] + counters["coalesced"])/lookups if lookups > 0 else 0.0
+    }
@@ -1,22 +1,26 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query
 import json
 import os
-from starlette.responses import HTMLResponse, UJSONResponse
+from starlette.responses import HTMLResponse, UJSONResponse, Response
 from typing import List
 import elastic
 import db
+import metrics
+import responses
+import searchcache
 from pydantic import BaseModel
 from starlette.requests import Request
-from copy import deepcopy
+from starlette.routing import Match
 
 
 app = FastAPI(__name__)
+SEARCH_FACETS = os.environ.get("SEARCH_FACETS", "true").lower() == "true"
 
 
 @app.on_event("startup")
 async def startupEvent():
 
-    global responseTemplate
+    global responseSkeleton
     with open("responseTemplate.json", encoding="utf-8") as file:
         responseTemplate = json.load(file)
 
@@ -24,9 +28,31 @@ async def startupEvent():
     responseTemplate["links"]["reports"] = os.environ["REPORTS_URL"]
     responseTemplate["logo"] = os.environ["LOGO_URL"]
     responseTemplate["name"] = os.environ["NAME"]
+    responseSkeleton = responses.compileTemplate(responseTemplate)
 
     await elastic.init()
     await db.init()
+    metrics.register(collectSearchCacheStats)
+
+
+@app.middleware("http")
+async def timeRequests(request: Request, call_next):
+    with metrics.timer("http_request_seconds", path=routeTemplate(request.scope)):
+        return await call_next(request)
+
+
+def routeTemplate(scope: dict):
+    # label by route template, raw paths would make a time series per URL
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+def collectSearchCacheStats():
+    for name, value in searchcache.stats().items():
+        metrics.setGauge("search_cache_" + name, value)
 
 
 @app.get("/")
@@ -38,31 +64,63 @@ async def search(request: Request,
                  acceptedCurrencies: List[str] = Query([]),
                  nsfw: bool = False,
                  contractTypes: List[str] = Query([]),
-                 sortBy: str = "relevance"):
-    
-    response = await elastic.getSearchResults(deepcopy(responseTemplate), q, ps, p, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes)
-
-    for option in response["options"]["shipsTo"]["options"]:
-        if option["value"] == shipsTo:
-            option["checked"] = True
-            break
-
-    for option in response["options"]["acceptedCurrencies"]["options"]:
-        if option["value"] in acceptedCurrencies:
-            option["checked"] = True
-
-    for option in response["options"]["nsfw"]["options"]:
-        if option["value"] == str(nsfw).lower():
-            option["checked"] = True
-            break
-    
-    for option in response["options"]["contractTypes"]["options"]:
-        if option["value"] in contractTypes:
-            option["checked"] = True
-
-    response["sortBy"][sortBy]["selected"] = True
-    response["links"]["self"] = str(request.url)
-    return response
+                 sortBy: str = "relevance",
+                 cursor: str = ""):
+
+    await searchcache.refreshVersion(db.getIndexVersion)
+    searchAfter = None
+    if cursor != "":
+        decodedCursor = elastic.decodeCursor(cursor)
+        if decodedCursor is not None:
+            p, searchAfter = decodedCursor
+
+    key = searchcache.makeKey(q, ps, p, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes)
+    if searchAfter is not None:
+        key = key + (tuple(searchAfter),)
+    elif p > 0:
+        searchAfter = searchcache.getCursor(searchcache.makeKey(q, ps, p-1, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes))
+    if elastic.pastResultWindow(ps, p, searchAfter):
+        raise HTTPException(status_code=400, detail="page {} is past the first {} results, follow links.next to page further with a cursor".format(p, elastic.MAX_RESULT_WINDOW))
+
+    facetKey = searchcache.makeKey(q, 0, 0, "", shipsTo, acceptedCurrencies, nsfw, contractTypes) + ("facets",)
+    withFacets = SEARCH_FACETS and searchcache.peek(facetKey) is None
+
+    async def fetchResults():
+        results, lastSort, facets = await elastic.getResults(q, ps, p, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes, searchAfter, withFacets)
+        if facets is not None:
+            searchcache.store(facetKey, responses.dumps(facets))
+        return responses.dumps(results), lastSort if results["morePages"] else None
+
+    async def fetchFacets():
+        facets = await elastic.getFacets(q, shipsTo, acceptedCurrencies, nsfw, contractTypes)
+        return responses.dumps(facets)
+
+    resultsJSON, lastSort = await searchcache.getOrCompute(key, fetchResults)
+    facetsJSON = await searchcache.getOrCompute(facetKey, fetchFacets) if SEARCH_FACETS else None
+
+    links = {"self": str(request.url)}
+    if lastSort is not None:
+        searchcache.rememberCursor(searchcache.makeKey(q, ps, p, sortBy, shipsTo, acceptedCurrencies, nsfw, contractTypes), lastSort)
+        links["next"] = str(request.url.include_query_params(p=p+1, cursor=elastic.encodeCursor(p+1, lastSort)))
+
+    checked = {
+        "shipsTo": {shipsTo},
+        "acceptedCurrencies": set(acceptedCurrencies),
+        "nsfw": {str(nsfw).lower()},
+        "contractTypes": set(contractTypes)
+    }
+    content = responses.renderResponse(responseSkeleton, links, checked, sortBy, resultsJSON, facetsJSON)
+    return Response(content=content, media_type="application/json")
+
+
+@app.get("/stats")
+async def stats():
+    return {"searchCache": searchcache.stats()}
+
+
+@app.get("/metrics")
+async def metricsEndpoint():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 class Report(BaseModel):
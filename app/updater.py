@@ -1,31 +1,47 @@
 import asyncio
 import random
 import json
+import os
 import time
 import db
 import obrequests
 import elastic
 import importer
+import log
+import metrics
+import repricer
+import worker
+
+
+UPDATE_BATCH_SIZE = int(os.environ.get("UPDATER_BATCH_SIZE", 50))
+UPDATE_LEASE_SECONDS = int(os.environ.get("UPDATER_LEASE_SECONDS", 600))
+REPRICE_INTERVAL = float(os.environ.get("UPDATER_REPRICE_INTERVAL", 3600))
+lastReprice = None
 
 
 async def updatePass():
-    peers = [peer[0] for peer in await db.getAllPeers()]
-    print("all peers:", len(peers))
-    peers = importer.getRandomSample(peers, 50)
-    print("random sample:", len(peers))
-    await asyncio.gather(*[importer.insertPeerAndListings(peerID) for peerID in peers])
+    peers = await db.leaseStalestPeers(UPDATE_BATCH_SIZE, UPDATE_LEASE_SECONDS)
+    log.info("leased peers:", len(peers))
+    start = time.monotonic()
+    updatedPeers = await importer.importPeers("update", peers)
+    duration = time.monotonic() - start
+    log.info("update pass: {}/{} peers, {} listings in {:.1f}s ({:.2f} peers/s, {:.2f} listings/s)".format(
+        len(updatedPeers), len(peers), sum(updatedPeers), duration,
+        len(updatedPeers)/duration if duration > 0 else 0, sum(updatedPeers)/duration if duration > 0 else 0))
+    return peers, updatedPeers
+
+
+async def updateRound():
+    global lastReprice
+    await updatePass()
+    if lastReprice is None or time.monotonic() - lastReprice >= REPRICE_INTERVAL:
+        with metrics.timer("worker_pass_seconds", role="reprice"):
+            await repricer.repricePass()
+        lastReprice = time.monotonic()
 
 
 async def update():
-    try:
-        await db.init()
-        await obrequests.init()
-        await elastic.init()
-        while True:
-            time.sleep(random.randint(10, 100))
-            await updatePass()
-    finally:
-        await elastic.close()
+    await worker.run(["update"])
 
 if __name__ == "__main__":
-    asyncio.run(update())
\ No newline at end of file
+    asyncio.run(update())
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import random
+import signal
+import db
+import obrequests
+import elastic
+import log
+import metrics
+import crawler
+import importer
+import updater
+
+
+WORKER_ROLES = [role.strip() for role in os.environ.get("WORKER_ROLES", "crawl,import,update").split(",") if role.strip() != ""]
+SLEEP_MIN = int(os.environ.get("WORKER_SLEEP_MIN", 10))
+SLEEP_MAX = int(os.environ.get("WORKER_SLEEP_MAX", 100))
+SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", 60))
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+
+
+def getRoles():
+    # role: (setup, pass, needs elasticsearch); built on demand since the role modules import this one
+    return {
+        "crawl": (crawler.warmKnownPeers, crawler.crawlRound, False),
+        "import": (None, importer.insertPass, True),
+        "update": (None, updater.updateRound, True)
+    }
+
+
+async def sleep(stopping: asyncio.Event, seconds: float):
+    try:
+        await asyncio.wait_for(stopping.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def runLoop(role: str, stopping: asyncio.Event):
+    setup, passFunction, _ = getRoles()[role]
+    if setup is not None:
+        await setup()
+    while not stopping.is_set():
+        await sleep(stopping, random.randint(SLEEP_MIN, SLEEP_MAX))
+        if stopping.is_set():
+            break
+        try:
+            with metrics.timer("worker_pass_seconds", role=role):
+                await passFunction()
+        except Exception as exception:
+            log.error(role, "pass failed:", repr(exception))
+    log.info(role, "loop stopped")
+
+
+async def run(roles: list = None):
+    roles = roles or WORKER_ROLES
+    for role in roles:
+        if role not in getRoles():
+            raise ValueError("unknown worker role: {}".format(role))
+    useElastic = any(getRoles()[role][2] for role in roles)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signalNumber, stopping.set)
+
+    metricsServer = None
+    try:
+        await db.init()
+        await obrequests.init()
+        if useElastic:
+            await elastic.init()
+        if METRICS_PORT > 0:
+            metricsServer = await metrics.startServer(METRICS_HOST, METRICS_PORT)
+            log.info("metrics served on port", METRICS_PORT)
+        log.info("worker running:", ", ".join(roles))
+        loops = [asyncio.ensure_future(runLoop(role, stopping)) for role in roles]
+        await stopping.wait()
+        log.info("shutting down, waiting up to {}s for running passes...".format(SHUTDOWN_TIMEOUT))
+        _, pending = await asyncio.wait(loops, timeout=SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+    finally:
+        if metricsServer is not None:
+            await metricsServer.cleanup()
+        await obrequests.close()
+        if useElastic:
+            await elastic.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())